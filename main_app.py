@@ -14,7 +14,23 @@ from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 import warnings
 import os
-from openai import OpenAI
+import sys
+import argparse
+import itertools
+import json
+import pickle
+import glob
+import shutil
+import hashlib
+import time
+import threading
+import collections
+import asyncio
+import httpx
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import sklearn
+from openai import OpenAI, AsyncOpenAI
+import pool_tasks
 warnings.filterwarnings('ignore')
 
 st.set_page_config(page_title="金融数据挖掘及其综合应用平台", layout='wide', initial_sidebar_state="expanded")
@@ -134,106 +150,1063 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ========== 数据加载（缓存） ==========
-@st.cache_data
+# ========== 列式磁盘缓存 ==========
+# 源文件首次解析后以Parquet写入CACHE_DIR，键为源文件路径+大小+修改时间，源文件变动后自动重新解析
+CACHE_DIR = os.environ.get("FIN_CACHE_DIR", ".data_cache")
+CACHE_VERSION = "5"  # 构建逻辑或存储格式变化时递增，使旧缓存失效
+
+def source_signature(paths):
+    h = hashlib.sha1(CACHE_VERSION.encode('utf-8'))
+    for p in paths:
+        stat = os.stat(p)
+        h.update(f"{os.path.abspath(p)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+def cache_file(name, paths):
+    try:
+        return os.path.join(CACHE_DIR, f"{name}-{source_signature(paths)}.parquet")
+    except OSError:
+        return None
+
+def read_cache(path):
+    if path and os.path.exists(path):
+        try: return pd.read_parquet(path)
+        except Exception: pass
+    return None
+
+def atomic_write(path, write):
+    # write(tmp)写出临时文件或目录后原子替换为path，读者不会看到半成品；
+    # 任何写入错误（如CACHE_DIR不可写）都只返回False，调用方按无缓存继续
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        write(tmp)
+        os.replace(tmp, path)
+        return True
+    except Exception:
+        try:
+            if os.path.isdir(tmp): shutil.rmtree(tmp)
+            elif os.path.exists(tmp): os.remove(tmp)
+        except OSError: pass
+        return os.path.isdir(path)  # 目录目标：其他进程已写好同一版本
+
+def remove_stale(pattern, keep):
+    for old in glob.glob(pattern):
+        if old == keep or old.endswith('.tmp'): continue
+        try:
+            if os.path.isdir(old): shutil.rmtree(old)
+            else: os.remove(old)
+        except OSError: pass
+
+def write_cache(name, path, df):
+    if path and atomic_write(path, df.to_parquet):
+        remove_stale(os.path.join(CACHE_DIR, f"{name}-*.parquet"), path)
+
+def combine_signatures(*signatures):
+    return hashlib.sha1("|".join(map(str, signatures)).encode('utf-8')).hexdigest()[:16]
+
+def cached_frame_path(name, signature):
+    return os.path.join(CACHE_DIR, f"{name}-{signature}.parquet")
+
+def cached_frame(name, signature, build):
+    # 派生表以其输入数据集的签名为键，build必须使用同一签名下加载的数据
+    path = cached_frame_path(name, signature)
+    df = read_cache(path)
+    if df is None:
+        df = build()
+        write_cache(name, path, df)
+    return df
+
+# ========== 并行数据摄取 ==========
+# INGEST_EXECUTOR=process|thread；Excel解析受GIL限制，默认使用进程池
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+INGEST_EXECUTOR = os.environ.get("INGEST_EXECUTOR", "process")
+INGEST_TIMINGS = {}
+
+def make_executor(kind, workers):
+    return ProcessPoolExecutor(max_workers=workers) if kind == "process" else ThreadPoolExecutor(max_workers=workers)
+
+def read_source(path):
+    return pd.read_excel(path) if path.endswith('.xlsx') else pd.read_csv(path)
+
+@pool_tasks.task
+def timed_read(path):
+    t0 = time.perf_counter()
+    df = read_source(path)
+    return df, time.perf_counter() - t0
+
+def read_sources(paths):
+    # 结果按输入顺序返回，保证拼接顺序确定
+    if len(paths) <= 1 or INGEST_WORKERS <= 1:
+        results = [timed_read(p) for p in paths]
+    else:
+        with make_executor(INGEST_EXECUTOR, min(INGEST_WORKERS, len(paths))) as ex:
+            results = list(ex.map(pool_tasks.bind(timed_read), paths))
+    for p, (df, secs) in zip(paths, results):
+        INGEST_TIMINGS[p] = (secs, len(df))
+    return [df for df, _ in results]
+
+# ========== 紧凑数据类型 ==========
+# 代码转为category（整数编码），价格类列降为float32（报价最多4位小数，float32约7位有效数字足够），
+# 成交量/成交额数值可达1e9以上，float32会丢失个位，保持float64；整数列降到最小位宽；
+# trade_date保持datetime64，各模块依赖其区间比较与.dt访问
+FLOAT32_COLUMNS = ('open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg')
+
+def compact_frame(df):
+    if 'ts_code' in df.columns:
+        df['ts_code'] = df['ts_code'].astype(str).str.strip().astype('category')
+    for col in df.select_dtypes(include='float64').columns:
+        if col in FLOAT32_COLUMNS:
+            df[col] = df[col].astype(np.float32)
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def memory_report(frames, mapped=None):
+    # mapped：{名称: 对象}，对象的footprint()返回(行数, 列数, 字节数, 存储方式)，用于mmap价格库与价格面板
+    rows = [(name, len(df), df.shape[1], df.memory_usage(deep=True).sum(), 'DataFrame') for name, df in frames.items()]
+    rows += [(name, *obj.footprint()) for name, obj in (mapped or {}).items()]
+    report = pd.DataFrame(rows, columns=['数据表', '行数', '列数', '内存(MB)', '存储'])
+    report['内存(MB)'] = report['内存(MB)'] / 2**20
+    return report.sort_values('内存(MB)', ascending=False).reset_index(drop=True)
+
+def build_trade_data(frames, paths):
+    df = pd.concat(frames, ignore_index=True)
+    df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d')
+    return compact_frame(df)
+
+def build_index_data(frames, paths):
+    # 指数行情按日期升序存放，供交易日历二分切片
+    return build_trade_data(frames, paths).sort_values('trade_date', kind='mergesort').reset_index(drop=True)
+
+def build_plain(frames, paths):
+    return pd.concat(frames, ignore_index=True)
+
+def build_industry_info(frames, paths):
+    industry_info = frames[0].dropna(subset=['新版一级行业', '股票代码'])
+    industry_info['股票代码'] = industry_info['股票代码'].astype(str).str.strip()
+    return industry_info
+
+def build_financial_data(frames, paths):
+    for df, p in zip(frames, paths):
+        df['年度'] = int(os.path.basename(p)[4:8])
+    financial_data = pd.concat(frames, ignore_index=True)
+    financial_data['ts_code'] = financial_data['ts_code'].astype(str).str.strip()
+    return financial_data
+
+def build_fin_data(frames, paths):
+    fin_data = frames[0]
+    fin_data['股票代码'] = fin_data['股票代码'].astype(str).str.strip()
+    return fin_data
+
+def build_stk_trdata(frames, paths):
+    return build_trade_data(frames, paths)
+
+# ========== 数据集注册表（按需加载） ==========
+# 名称 -> (显示名, 源文件, 构建函数, 是否可选)；可选数据集缺失文件时跳过且不报错
+DATASETS = {
+    'trade_data': ('交易数据', ['交易数据2024.csv', '交易数据2025.csv'], build_trade_data, False),
+    'adj_trade_data': ('复权交易数据', ['复权交易数据2023.csv', '复权交易数据2024.csv', '复权交易数据2025.csv'], build_trade_data, False),
+    'hs300_data': ('沪深300指数数据', ['沪深300指数交易数据.xlsx'], build_index_data, False),
+    'index_data': ('指数数据', ['index_trdata.csv'], build_trade_data, False),
+    'stock_basic': ('股票基本信息', ['股票基本信息表.xlsx'], build_plain, False),
+    'company_info': ('上市公司信息', ['上市公司基本信息.xlsx'], build_plain, False),
+    'industry_info': ('行业分类', ['最新个股申万行业分类(完整版-截至7月末).xlsx'], build_industry_info, False),
+    'financial_data': ('财务数据', [f'Data{y}.xlsx' for y in range(2018, 2025)], build_financial_data, True),
+    'fin_data': ('财务指标数据', ['fin_data.csv'], build_fin_data, True),
+    'stk_trdata': ('股票日线数据', ['stk_trdata.csv'], build_stk_trdata, True),
+}
+
+def dataset_sources(name):
+    _, sources, _, optional = DATASETS[name]
+    return [p for p in sources if os.path.exists(p)] if optional else sources
+
+def dataset_is_cold(name):
+    # 源文件齐全但尚无有效磁盘缓存
+    paths = dataset_sources(name)
+    path = cache_file(name, paths)
+    return path is not None and not os.path.exists(path)
+
+def ingest_datasets(names):
+    # 所有待解析数据集的源文件放入同一个池并发读取，再按注册顺序逐个构建
+    frames, todo = {}, []
+    for name in names:
+        path = cache_file(name, dataset_sources(name))
+        df = read_cache(path)
+        if df is None: todo.append((name, path))
+        else: frames[name] = df
+    raw = iter(read_sources([p for name, _ in todo for p in dataset_sources(name)]))
+    for name, path in todo:
+        paths = dataset_sources(name)
+        df = DATASETS[name][2]([next(raw) for _ in paths], paths)
+        write_cache(name, path, df)
+        frames[name] = df
+    return frames
+
+def build_dataset(name):
+    return ingest_datasets([name])[name]
+
+def fetch_dataset(name):
+    label, _, _, optional = DATASETS[name]
+    with st.spinner(f'加载{label}...'):
+        try:
+            return build_dataset(name)
+        except Exception as e:
+            if not optional: st.error(f"加载{label}失败: {e}")
+            return None
+
+def dataset_signature(name):
+    try: return source_signature(dataset_sources(name))
+    except OSError: return None
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def load_dataset(name, signature):
+    # signature只作缓存键：源文件变化后按新签名重新加载，不会沿用内存中的旧表
+    return fetch_dataset(name)
+
+# ========== 交易日历 ==========
+# 升序日期数组上的区间查询：起止日期二分定位为整数位置，按位置iloc切片返回视图，不构造布尔掩码
+def date_span(dates, start=None, end=None):
+    lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), 'left'))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(end)), 'right'))
+    return lo, max(lo, hi)
+
+class TradingCalendar:
+    def __init__(self, dates):
+        self.dates = dates.to_numpy() if isinstance(dates, pd.Series) else np.asarray(dates)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def position(self, day):
+        # 当日或之后的第一个交易日的位置
+        return int(np.searchsorted(self.dates, np.datetime64(pd.Timestamp(day)), 'left'))
+
+    def span(self, start=None, end=None):
+        return date_span(self.dates, start, end)
+
+    def slice(self, frame, start=None, end=None):
+        # frame的行须与日历日期一一对应且升序
+        lo, hi = self.span(start, end)
+        return frame.iloc[lo:hi]
+
+# ========== 只读mmap数组目录 ==========
+# 按签名命名的.npy目录，各会话、各worker进程以只读mmap映射同一批页面
+def save_arrays(directory, arrays):
+    os.makedirs(directory)
+    for key, arr in arrays.items(): np.save(os.path.join(directory, f'{key}.npy'), arr)
+
+def mapped_arrays(kind, name, signature, build):
+    # 目录缺失时由build()生成{文件名: 数组}写入，build返回None表示无数据；写不进CACHE_DIR时直接用内存中的数组
+    directory = os.path.join(CACHE_DIR, f"{kind}-{name}-{signature}")
+    if not os.path.isdir(directory):
+        arrays = build()
+        if arrays is None: return None
+        if not atomic_write(directory, lambda tmp: save_arrays(tmp, arrays)): return arrays
+        remove_stale(os.path.join(CACHE_DIR, f"{kind}-{name}-*"), directory)
+    return {f[:-4]: np.load(os.path.join(directory, f), mmap_mode='r') for f in os.listdir(directory) if f.endswith('.npy')}
+
+# ========== 按(ts_code, trade_date)索引的价格库 ==========
+# 行情表按代码、日期排序后保存每只股票的行区间，单股切片为O(1)定位+日期二分。
+# 各列以.npy写入CACHE_DIR并以只读mmap打开，单股查询只读取该股的行，不在进程内常驻全量长表
+PRICE_DATASETS = ('trade_data', 'adj_trade_data')
+
+class PriceStore:
+    def __init__(self, df, presorted=False):
+        df = df if presorted else df.sort_values(['ts_code', 'trade_date'], kind='mergesort').reset_index(drop=True)
+        codes = df['ts_code']
+        ids = codes.cat.codes.to_numpy() if isinstance(codes.dtype, pd.CategoricalDtype) else codes.to_numpy()
+        bounds = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        starts, ends = (np.r_[0, bounds], np.r_[bounds, len(ids)]) if len(ids) else (np.array([], int), np.array([], int))
+        self._setup(codes.to_numpy()[starts].astype(str), starts, ends, {c: df[c].to_numpy() for c in df.columns if c != 'ts_code'})
+        self._frame = df
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        store = cls.__new__(cls)
+        names = [str(c) for c in arrays['columns']]
+        store._setup(np.asarray(arrays['codes']), np.asarray(arrays['starts']), np.asarray(arrays['ends']), {c: arrays[c] for c in names})
+        store._frame = None
+        return store
+
+    def to_arrays(self):
+        # 只保存数值与日期列，均可直接mmap
+        names = [c for c, a in self.columns.items() if a.dtype.kind in 'biufM']
+        return {'codes': self.codes.astype(str), 'starts': self.starts.astype(np.int64), 'ends': self.ends.astype(np.int64),
+                'columns': np.array(names, dtype=str), **{c: self.columns[c] for c in names}}
+
+    def _setup(self, codes, starts, ends, columns):
+        self.codes, self.starts, self.ends, self.columns = codes, starts, ends, columns
+        self.code_dtype = pd.CategoricalDtype(pd.Index(codes))
+        self.offsets = dict(zip(codes.tolist(), zip(starts.tolist(), ends.tolist())))
+        self.dates = columns['trade_date']
+
+    def __len__(self):
+        return len(self.dates)
+
+    def footprint(self):
+        arrays = list(self.columns.values())
+        kind = 'mmap共享' if isinstance(self.dates, np.memmap) else '进程内'
+        return len(self), len(arrays) + 1, sum(a.nbytes for a in arrays) + self.starts.nbytes + self.ends.nbytes, kind
+
+    @property
+    def frame(self):
+        # mmap模式下全量长表只在构建派生表时临时物化，不缓存
+        if self._frame is not None: return self._frame
+        ids = np.repeat(np.arange(len(self.codes)), self.ends - self.starts)
+        return pd.DataFrame({'ts_code': pd.Categorical.from_codes(ids, dtype=self.code_dtype),
+                             **{c: np.array(a) for c, a in self.columns.items()}})
+
+    def _take(self, rows, index, positions):
+        out = pd.DataFrame({c: np.array(a[rows]) for c, a in self.columns.items()}, index=index)
+        out.insert(0, 'ts_code', pd.Categorical.from_codes(positions, dtype=self.code_dtype))
+        return out
+
+    def get_history(self, code, start=None, end=None):
+        lo, hi = self.offsets.get(code, (0, 0))
+        first, last = date_span(self.dates[lo:hi], start, end)
+        a, b = lo + first, lo + last
+        if self._frame is not None: return self._frame.iloc[a:b]
+        pos = self.code_dtype.categories.get_loc(code) if b > a else 0
+        return self._take(slice(a, b), pd.RangeIndex(a, b), np.full(b - a, pos))
+
+    def latest(self, codes):
+        # 各股票在全市场最新交易日的行，当日无行情的股票不出现
+        last = self.ends - 1
+        keep = np.flatnonzero(pd.Index(self.codes).isin([str(c) for c in codes]))
+        if len(keep): keep = keep[np.asarray(self.dates[last[keep]]) == np.asarray(self.dates[last]).max()]
+        rows = last[keep]
+        if self._frame is not None: return self._frame.iloc[rows]
+        return self._take(rows, pd.Index(rows), keep)
+
+@st.cache_resource(show_spinner=False)
+def load_price_store(name, signature):
+    # 进程内所有会话共享同一份映射；signature随源文件变化使缓存失效
+    def build():
+        df = fetch_dataset(name)
+        return None if df is None else PriceStore(df).to_arrays()
+    arrays = mapped_arrays('store', name, signature, build)
+    return None if arrays is None else PriceStore.from_arrays(arrays)
+
 def load_data():
     data_dict = {}
+    for name in DATASETS:
+        df = load_dataset(name, dataset_signature(name))
+        if df is not None: data_dict[name] = df
+    return data_dict
+
+# ========== 共享内存映射价格面板 ==========
+# 日期×股票的稠密矩阵以.npy写入CACHE_DIR，各会话、各worker进程以只读mmap方式映射同一批页面
+PANEL_FIELDS = ('close', 'high', 'low', 'vol', 'pct_chg')
+
+def panel_arrays(df):
+    codes = np.sort(df['ts_code'].astype(str).unique())
+    dates = np.sort(df['trade_date'].unique())
+    rows = np.searchsorted(dates, df['trade_date'].to_numpy())
+    cols = np.searchsorted(codes, df['ts_code'].astype(str).to_numpy())
+    arrays = {'codes': codes.astype(str), 'dates': np.asarray(dates, dtype='datetime64[ns]')}
+    for field in PANEL_FIELDS:
+        dtype = np.float32 if field in FLOAT32_COLUMNS else np.float64
+        arrays[field] = np.full((len(dates), len(codes)), np.nan, dtype=dtype)
+        arrays[field][rows, cols] = df[field].to_numpy(dtype=dtype)
+    return arrays
+
+class PricePanel:
+    def __init__(self, arrays):
+        self.codes = pd.Index(np.asarray(arrays['codes']))
+        self.dates = np.asarray(arrays['dates'])
+        self.calendar = TradingCalendar(self.dates)
+        self.arrays = {f: arrays[f] for f in PANEL_FIELDS}
+
+    def date_range(self, start=None, end=None):
+        return self.calendar.span(start, end)
+
+    def footprint(self):
+        # 行为交易日，列为股票×字段
+        kind = 'mmap共享' if isinstance(self.arrays['close'], np.memmap) else '进程内'
+        return len(self.dates), len(self.codes) * len(self.arrays), sum(a.nbytes for a in self.arrays.values()), kind
+
+    def frame(self, field, codes=None, start=None, end=None):
+        lo, hi = self.date_range(start, end)
+        block = self.arrays[field][lo:hi]
+        index = pd.DatetimeIndex(self.dates[lo:hi], name='trade_date')
+        if codes is None:
+            return pd.DataFrame(block, index=index, columns=self.codes, copy=False)
+        cols = self.codes.get_indexer([str(c) for c in codes])
+        present = cols >= 0
+        return pd.DataFrame(block[:, cols[present]], index=index, columns=self.codes[cols[present]])
+
+@st.cache_resource(show_spinner=False)
+def load_price_panel(name, signature):
+    def build():
+        df = fetch_dataset(name)
+        return None if df is None else panel_arrays(df)
+    arrays = mapped_arrays('panel', name, signature, build)
+    return None if arrays is None else PricePanel(arrays)
+
+# ========== 行业指数表 ==========
+# 全部申万一级行业的成交量加权指数一次groupby算出（行业×交易日），与数据一起以Parquet缓存，切换行业只是索引查找
+def map_codes(codes, mapping):
+    # category列只需映射各类别一次
+    if isinstance(codes.dtype, pd.CategoricalDtype):
+        mapped = pd.Series(codes.cat.categories.astype(str)).map(mapping).to_numpy()
+        return np.where(codes.cat.codes.to_numpy() >= 0, mapped[codes.cat.codes.to_numpy()], None)
+    return codes.astype(str).map(mapping).to_numpy()
+
+def build_industry_index_table(prices, industry_info):
+    mapping = industry_info.drop_duplicates('股票代码').set_index('股票代码')['新版一级行业']
+    close, vol = prices['close'].to_numpy(dtype=float), prices['vol'].to_numpy(dtype=float)
+    df = pd.DataFrame({'行业': map_codes(prices['ts_code'], mapping), 'trade_date': prices['trade_date'].to_numpy(),
+                       'amount_w': close * vol, 'vol': vol, 'pct_chg': prices['pct_chg'].to_numpy(dtype=float)})
+    df = df[df['行业'].notna()]
+    table = df.groupby(['行业', 'trade_date'], sort=True).agg(amount_w=('amount_w', 'sum'), vol=('vol', 'sum'),
+                                                               pct_chg=('pct_chg', 'mean'), stocks=('pct_chg', 'size'))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['price'] = table['amount_w'] / table['vol']
+    return table.drop(columns='amount_w')
+
+@st.cache_resource(show_spinner=False)
+def load_industry_index(price_signature, industry_signature):
+    def build():
+        store = load_price_store('adj_trade_data', price_signature)
+        industry_info = load_dataset('industry_info', industry_signature)
+        if store is None or industry_info is None: raise ValueError('行情或行业数据缺失')
+        return build_industry_index_table(store.frame, industry_info)
     try:
-        with st.spinner('加载交易数据...'):
-            trade_data_2024 = pd.read_csv('交易数据2024.csv')
-            trade_data_2025 = pd.read_csv('交易数据2025.csv')
-            adj_trade_2023 = pd.read_csv('复权交易数据2023.csv')
-            adj_trade_2024 = pd.read_csv('复权交易数据2024.csv')
-            adj_trade_2025 = pd.read_csv('复权交易数据2025.csv')
-            trade_data = pd.concat([trade_data_2024, trade_data_2025], ignore_index=True)
-            adj_trade_data = pd.concat([adj_trade_2023, adj_trade_2024, adj_trade_2025], ignore_index=True)
-            for df in [trade_data, adj_trade_data]:
-                df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d')
-            data_dict['trade_data'] = trade_data
-            data_dict['adj_trade_data'] = adj_trade_data
-        with st.spinner('加载指数数据...'):
-            hs300_data = pd.read_excel('沪深300指数交易数据.xlsx')
-            hs300_data['trade_date'] = pd.to_datetime(hs300_data['trade_date'], format='%Y%m%d')
-            data_dict['hs300_data'] = hs300_data
-            index_data = pd.read_csv('index_trdata.csv')
-            index_data['trade_date'] = pd.to_datetime(index_data['trade_date'], format='%Y%m%d')
-            data_dict['index_data'] = index_data
-        with st.spinner('加载股票基本信息...'):
-            stock_basic = pd.read_excel('股票基本信息表.xlsx')
-            company_info = pd.read_excel('上市公司基本信息.xlsx')
-            data_dict['stock_basic'] = stock_basic
-            data_dict['company_info'] = company_info
-        with st.spinner('加载行业分类...'):
-            industry_info = pd.read_excel('最新个股申万行业分类(完整版-截至7月末).xlsx')
-            industry_info = industry_info.dropna(subset=['新版一级行业', '股票代码'])
-            industry_info['股票代码'] = industry_info['股票代码'].astype(str).str.strip()
-            data_dict['industry_info'] = industry_info
-        with st.spinner('加载财务数据...'):
-            years = [2018,2019,2020,2021,2022,2023,2024]
-            fin_list = []
-            for y in years:
-                try:
-                    df = pd.read_excel(f'Data{y}.xlsx')
-                    df['年度'] = y
-                    fin_list.append(df)
-                except: pass
-            if fin_list:
-                financial_data = pd.concat(fin_list, ignore_index=True)
-                financial_data['ts_code'] = financial_data['ts_code'].astype(str).str.strip()
-                data_dict['financial_data'] = financial_data
-            try:
-                fin_data = pd.read_csv('fin_data.csv')
-                fin_data['股票代码'] = fin_data['股票代码'].astype(str).str.strip()
-                data_dict['fin_data'] = fin_data
-            except: pass
-        with st.spinner('加载股票日线数据...'):
+        with st.spinner('计算行业指数...'):
+            return cached_frame('industry_index', combine_signatures(price_signature, industry_signature), build)
+    except Exception:
+        return None
+
+# ========== 每日市场汇总 ==========
+# 摄取时按交易日预先汇总全市场涨跌家数、平均/中位涨跌幅、总成交量，连同行业指数表（分行业汇总）通过MarketSummary查询
+def build_market_summary(prices):
+    pct = prices['pct_chg'].to_numpy(dtype=float)
+    df = pd.DataFrame({'trade_date': prices['trade_date'].to_numpy(), 'pct_chg': pct, 'vol': prices['vol'].to_numpy(dtype=float),
+                       'up': pct > 0, 'down': pct < 0, 'flat': pct == 0})
+    return df.groupby('trade_date', sort=True).agg(stocks=('pct_chg', 'size'), advancers=('up', 'sum'), decliners=('down', 'sum'),
+                                                   unchanged=('flat', 'sum'), mean_pct=('pct_chg', 'mean'),
+                                                   median_pct=('pct_chg', 'median'), total_vol=('vol', 'sum'))
+
+class MarketSummary:
+    def __init__(self, daily, industries):
+        self.daily = daily
+        self.industries = industries
+
+    def latest(self):
+        return None if self.daily.empty else self.daily.iloc[-1]
+
+    def on(self, day):
+        ts = pd.Timestamp(day)
+        return self.daily.loc[ts] if ts in self.daily.index else None
+
+    def range(self, start=None, end=None):
+        return self.daily.loc[pd.Timestamp(start) if start else None:pd.Timestamp(end) if end else None]
+
+    def industry_latest(self, industry):
+        # 行业在行情表最新交易日的汇总行，当日无成交时返回None
+        if self.industries is None or self.industries.empty: return None
+        latest = self.industries.index.get_level_values('trade_date').max()
+        key = (industry, latest)
+        return self.industries.loc[key] if key in self.industries.index else None
+
+@st.cache_resource(show_spinner=False)
+def load_market_summary(trade_signature, price_signature, industry_signature):
+    def build():
+        store = load_price_store('trade_data', trade_signature)
+        if store is None: raise ValueError('交易数据缺失')
+        return build_market_summary(store.frame)
+    try:
+        daily = cached_frame('market_summary', trade_signature, build)
+    except Exception:
+        daily = pd.DataFrame()
+    return MarketSummary(daily, load_industry_index(price_signature, industry_signature))
+
+# ========== 财务面板（股票×年度） ==========
+# fin_data与financial_data按(股票代码, 年度)预先合并并打上行业标签、计算同比增长；行业×年度汇总单独物化
+def build_financial_panel(fin_data, financial_data, industry_info):
+    key = ['股票代码', '年度']
+    parts = []
+    if fin_data is not None and not fin_data.empty:
+        parts.append(fin_data.drop_duplicates(key, keep='last').set_index(key))
+    if financial_data is not None and not financial_data.empty:
+        extra = financial_data.rename(columns={'ts_code': '股票代码'}).drop_duplicates(key, keep='last').set_index(key)
+        parts.append(extra[[c for c in ('营业收入', '营业利润') if c in extra.columns]])
+    if not parts: return pd.DataFrame()
+    panel = parts[0]
+    for part in parts[1:]:
+        panel = panel.combine_first(part)
+    panel = panel.sort_index()
+    if industry_info is not None and not industry_info.empty:
+        tags = industry_info.drop_duplicates('股票代码').set_index('股票代码')['新版一级行业']
+        panel['行业'] = tags.reindex(panel.index.get_level_values('股票代码')).to_numpy()
+    codes = panel.index.get_level_values('股票代码')
+    years = panel.index.get_level_values('年度').to_numpy()
+    # 仅相邻年度计算同比，缺年的记录增长率留空
+    consecutive = (codes[1:] == codes[:-1]) & (years[1:] - years[:-1] == 1)
+    for col, growth in (('营业收入', '营收增长率'), ('净利润', '净利润增长率'), ('营业利润', '营业利润增长率')):
+        if col not in panel.columns: continue
+        values = panel[col].to_numpy(dtype=float)
+        out = np.full(len(values), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[1:] = np.where(consecutive, (values[1:] / values[:-1] - 1) * 100, np.nan)
+        panel[growth] = out
+    if {'净利润', '营业收入'} <= set(panel.columns):
+        panel['净利率'] = panel['净利润'] / panel['营业收入']
+    return panel
+
+def build_industry_year_stats(financial_data, industry_info):
+    merged = pd.merge(financial_data, industry_info[['股票代码','新版一级行业']], left_on='ts_code', right_on='股票代码', how='inner')
+    stats = merged.groupby(['新版一级行业','年度']).agg({'营业收入':'sum','营业利润':'sum'}).reset_index()
+    stats['营收增长率'] = stats.groupby('新版一级行业')['营业收入'].pct_change()*100
+    return stats
+
+class FinancialPanel:
+    def __init__(self, table, industry_stats):
+        self.table = table
+        self.industry_stats = industry_stats
+        self.years = sorted(table.index.get_level_values('年度').unique()) if not table.empty else []
+
+    def stock(self, code, ascending=False):
+        if self.table.empty or code not in self.table.index.get_level_values('股票代码'): return pd.DataFrame()
+        return self.table.loc[[code]].sort_index(level='年度', ascending=ascending).reset_index()
+
+    def year(self, year, codes=None):
+        if year not in self.years: return pd.DataFrame()
+        rows = self.table.xs(year, level='年度', drop_level=False)
+        if codes is not None: rows = rows[rows.index.get_level_values('股票代码').isin(codes)]
+        return rows.reset_index()
+
+    def latest(self, codes):
+        # 给定股票集合中最近一个有数据的年度
+        rows = self.table[self.table.index.get_level_values('股票代码').isin(codes)] if not self.table.empty else self.table
+        if rows.empty: return pd.DataFrame()
+        latest = rows.index.get_level_values('年度').max()
+        return rows.xs(latest, level='年度', drop_level=False).reset_index()
+
+    def industry_year(self, year=None):
+        stats = self.industry_stats
+        if stats is None or stats.empty: return pd.DataFrame()
+        return stats[stats['年度'] == (stats['年度'].max() if year is None else year)]
+
+@st.cache_resource(show_spinner=False)
+def load_financial_panel(fin_signature, financial_signature, industry_signature):
+    if not dataset_sources('fin_data') and not dataset_sources('financial_data'): return None
+    def build_table():
+        return build_financial_panel(load_dataset('fin_data', fin_signature), load_dataset('financial_data', financial_signature),
+                                     load_dataset('industry_info', industry_signature))
+    def build_stats():
+        financial_data, industry_info = load_dataset('financial_data', financial_signature), load_dataset('industry_info', industry_signature)
+        if financial_data is None or industry_info is None: return pd.DataFrame()
+        return build_industry_year_stats(financial_data, industry_info)
+    try:
+        table = cached_frame('financial_panel', combine_signatures(fin_signature, financial_signature, industry_signature), build_table)
+        stats = cached_frame('industry_year_stats', combine_signatures(financial_signature, industry_signature), build_stats)
+    except Exception:
+        return None
+    return FinancialPanel(table, stats)
+
+class LazyData:
+    # 与原data_dict接口一致（get），首次访问时才加载对应数据集
+    def __init__(self):
+        self._frames = {}
+        self._stores = {}
+
+    def get(self, name, default=None):
+        if name not in self._frames:
+            if name in PRICE_DATASETS:
+                store = self.store(name)
+                self._frames[name] = None if store is None else store.frame
+            else:
+                self._frames[name] = load_dataset(name, dataset_signature(name))
+        df = self._frames[name]
+        return default if df is None else df
+
+    def store(self, name):
+        if name not in self._stores:
+            self._stores[name] = load_price_store(name, dataset_signature(name))
+        return self._stores[name]
+
+    def market_summary(self):
+        if 'market_summary' not in self._stores:
+            self._stores['market_summary'] = load_market_summary(dataset_signature('trade_data'), dataset_signature('adj_trade_data'),
+                                                                 dataset_signature('industry_info'))
+        return self._stores['market_summary']
+
+    def financials(self):
+        if 'financials' not in self._stores:
+            self._stores['financials'] = load_financial_panel(dataset_signature('fin_data'), dataset_signature('financial_data'),
+                                                              dataset_signature('industry_info'))
+        return self._stores['financials']
+
+    def industry_index(self):
+        if 'industry_index' not in self._stores:
+            self._stores['industry_index'] = load_industry_index(dataset_signature('adj_trade_data'), dataset_signature('industry_info'))
+        return self._stores['industry_index']
+
+    def panel(self, name):
+        key = ('panel', name)
+        if key not in self._stores:
+            self._stores[key] = load_price_panel(name, dataset_signature(name))
+        return self._stores[key]
+
+    def indicators(self, name):
+        key = ('indicators', name)
+        if key not in self._stores:
+            self._stores[key] = load_indicator_table(name, dataset_signature(name))
+        return self._stores[key]
+
+    def loaded(self):
+        return {name: df for name, df in self._frames.items() if df is not None}
+
+    def mapped(self):
+        # 已打开的价格库、价格面板与指标表，按数据集名标注
+        labels = {'store': '价格库', 'panel': '价格面板', 'indicators': '指标表'}
+        out = {}
+        for key, obj in self._stores.items():
+            if isinstance(obj, (PriceStore, PricePanel)):
+                kind, name = key if isinstance(key, tuple) else ('store', key)
+                out[f"{name}（{labels[kind]}）"] = obj
+        return out
+
+    def preload(self, names):
+        # 派生表缓存缺失时，其输入数据集与模块直接使用的数据集一起并行解析
+        tables = [n for n in names if n in DERIVED_TABLES]
+        datasets = [n for n in names if n not in DERIVED_TABLES]
+        needed = list(dict.fromkeys(datasets + [d for n in tables for d in derived_inputs(n)]))
+        cold = [n for n in needed if n not in self._frames and dataset_is_cold(n)]
+        if len(cold) > 1:
             try:
-                stk_trdata = pd.read_csv('stk_trdata.csv')
-                stk_trdata['trade_date'] = pd.to_datetime(stk_trdata['trade_date'], format='%Y%m%d')
-                stk_trdata['ts_code'] = stk_trdata['ts_code'].astype(str).str.strip()
-                data_dict['stk_trdata'] = stk_trdata
-            except: pass
-        st.success("数据加载完成！")
-    except Exception as e:
-        st.error(f"加载失败: {e}")
-    return data_dict
+                with st.spinner('并行加载数据...'):
+                    frames = ingest_datasets(cold)
+                self._frames.update({k: v for k, v in frames.items() if k not in PRICE_DATASETS and k in datasets})
+            except Exception: pass
+        for name in datasets:
+            if name in PRICE_DATASETS: self.store(name)
+            else: self.get(name)
+        for name in tables: getattr(self, name)()
+
+# ========== 派生表依赖 ==========
+# 派生表名与LazyData上的同名方法对应；缓存已在时不需要任何原始数据集
+DERIVED_TABLES = ('industry_index', 'market_summary', 'financials')
+
+def derived_inputs(name):
+    # 派生表缓存缺失时构建它要读取的原始数据集
+    sig = dataset_signature
+    if name == 'industry_index':
+        path = cached_frame_path('industry_index', combine_signatures(sig('adj_trade_data'), sig('industry_info')))
+        return [] if os.path.exists(path) else ['adj_trade_data', 'industry_info']
+    if name == 'market_summary':
+        daily = [] if os.path.exists(cached_frame_path('market_summary', sig('trade_data'))) else ['trade_data']
+        return daily + derived_inputs('industry_index')
+    if name == 'financials':
+        panel = cached_frame_path('financial_panel', combine_signatures(sig('fin_data'), sig('financial_data'), sig('industry_info')))
+        stats = cached_frame_path('industry_year_stats', combine_signatures(sig('financial_data'), sig('industry_info')))
+        names = ([] if os.path.exists(panel) else ['fin_data', 'financial_data', 'industry_info']) + \
+                ([] if os.path.exists(stats) else ['financial_data', 'industry_info'])
+        return [n for n in dict.fromkeys(names) if dataset_sources(n)]
+    return []
+
+def uses_datasets(*names):
+    # 声明功能模块依赖的数据集与派生表（DERIVED_TABLES），main()据此预加载；只在main()分派的顶层模块上声明
+    def wrap(func):
+        func.datasets = names
+        return func
+    return wrap
+
+# ========== 多因子打分 ==========
+# 因子名 -> 方向（1越大越好，-1越小越好），取自财务面板列；打分与排名在整个截面上一次完成
+FACTORS = {'净资产收益率': 1, '净利率': 1, '营收增长率': 1, '净利润增长率': 1, '营业利润增长率': 1}
+DEFAULT_FACTOR_WEIGHTS = {'净资产收益率': 0.5, '净利率': 0.5}
+
+def score_factors(frame, weights, zscore=True, group=None):
+    # zscore=False时按原始值加权（缺失记0）；group给定时在组内（如行业）做截面标准化
+    names = [f for f in weights if f in frame.columns]
+    out = frame.copy()
+    if not names or out.empty:
+        out['综合得分'] = 0.0
+        return out
+    values = out[names].astype(float) * np.array([FACTORS.get(f, 1) for f in names])
+    if zscore:
+        values = values.replace([np.inf, -np.inf], np.nan)
+        grouped = values.groupby(out[group].to_numpy()) if group else None
+        mean = grouped.transform('mean') if grouped else values.mean()
+        std = grouped.transform('std') if grouped else values.std()
+        values = (values - mean) / std.replace(0, np.nan)
+    w = np.array([weights[f] for f in names], dtype=float)
+    out['综合得分'] = values.fillna(0).to_numpy() @ w / (np.abs(w).sum() if zscore and np.abs(w).sum() else 1)
+    return out
+
+def rank_stocks(financials, year, weights, codes=None, zscore=True, neutralize=False, top=None):
+    fin = financials.year(year, codes)
+    if fin.empty: return fin
+    ranked = score_factors(fin, weights, zscore=zscore, group='行业' if neutralize and '行业' in fin.columns else None)
+    ranked = ranked.sort_values('综合得分', ascending=False, kind='mergesort')
+    return ranked.head(top) if top else ranked
+
+def basket_returns(panel, codes, start, end):
+    # 每只股票区间内首末有效收盘价之比，区间内不足两个交易日记0（与calculate_cumulative_returns一致）
+    frame = panel.frame('close', codes, start, end)
+    result = pd.Series(0.0, index=pd.Index([str(c) for c in codes]))
+    close = frame.to_numpy(dtype=float)
+    if close.size == 0: return result
+    valid = ~np.isnan(close)
+    count = valid.sum(axis=0)
+    first = valid.argmax(axis=0)
+    last = len(close) - 1 - valid[::-1].argmax(axis=0)
+    idx = np.arange(close.shape[1])
+    rets = np.where(count >= 2, (close[last, idx] / close[first, idx] - 1) * 100, 0.0)
+    result.loc[frame.columns] = rets
+    return result
 
 # ========== 技术指标、模型训练等辅助函数 ==========
-def calculate_technical_indicators(df, period=20):
+def calculate_technical_indicators(df, period=20, indicators=None):
+    # indicators为None时计算全部指标，否则只计算所需的依赖子图
     if df.empty or len(df) < 30: return df
     df = df.sort_values('trade_date').copy()
-    df['MA5'] = df['close'].rolling(5,1).mean()
-    df['MA10'] = df['close'].rolling(10,1).mean()
-    df['MA20'] = df['close'].rolling(20,1).mean()
-    df['MA60'] = df['close'].rolling(60,1).mean()
-    exp1 = df['close'].ewm(span=12, adjust=False).mean()
-    exp2 = df['close'].ewm(span=26, adjust=False).mean()
-    df['MACD'] = exp1 - exp2
-    df['MACD_Signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
-    df['MACD_Hist'] = df['MACD'] - df['MACD_Signal']
-    delta = df['close'].diff()
-    gain = delta.where(delta > 0, 0).rolling(14,1).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(14,1).mean()
-    rs = gain / loss
-    df['RSI'] = 100 - (100 / (1+rs))
-    low_min = df['low'].rolling(9,1).min()
-    high_max = df['high'].rolling(9,1).max()
-    df['K'] = 100 * (df['close'] - low_min) / (high_max - low_min)
-    df['D'] = df['K'].rolling(3,1).mean()
-    df['J'] = 3*df['K'] - 2*df['D']
-    df['OBV'] = (np.sign(df['close'].diff()) * df['vol']).fillna(0).cumsum()
-    df['Return'] = df['close'].pct_change()
-    df['Volume_Ratio'] = df['vol'] / df['vol'].rolling(5,1).mean()
-    df['Momentum'] = df['close'] - df['close'].shift(5)
+    cols = compute_indicators(df, indicators)
+    for col in cols.columns: df[col] = cols[col]
     return df
 
+# ========== 全市场向量化技术指标 ==========
+# 按(ts_code, trade_date)排序的长表上，以每只股票的行区间做分组运算：滚动均值用累计和差分，
+# 滚动极值用窗口内逐位移取fmin/fmax，EWM按"组内位置"递推（每步对所有股票同时计算），一次算完全市场
+class GroupLayout:
+    def __init__(self, starts, ends):
+        lengths = ends - starts
+        self.n = int(lengths.sum())
+        self.first = np.repeat(starts, lengths)
+        self.last = np.repeat(ends - 1, lengths)
+        self.pos = np.arange(self.n) - self.first
+        self.starts, self.lengths = starts, lengths
+
+    @classmethod
+    def single(cls, n):
+        return cls(np.array([0]), np.array([n]))
+
+    def shift(self, x, k):
+        out = np.full(self.n, np.nan)
+        if k < self.n: out[k:] = x[:self.n-k]
+        out[self.pos < k] = np.nan
+        return out
+
+    def lead(self, x, k):
+        out = np.full(self.n, np.nan)
+        if k < self.n: out[:self.n-k] = x[k:]
+        out[np.arange(self.n) + k > self.last] = np.nan
+        return out
+
+    def diff(self, x):
+        return x - self.shift(x, 1)
+
+    def rolling_mean(self, x, window):
+        # 与pandas rolling一致，±inf按缺失处理；否则一个inf会让累计和之后的所有行都变成inf/NaN
+        valid = np.isfinite(x)
+        cs = np.r_[0.0, np.cumsum(np.where(valid, x, 0.0))]
+        cn = np.r_[0, np.cumsum(valid)]
+        i = np.arange(self.n)
+        lo = np.maximum(i - window + 1, self.first)
+        count = cn[i+1] - cn[lo]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, (cs[i+1] - cs[lo]) / count, np.nan)
+
+    def rolling_min(self, x, window):
+        out = x.astype(float)
+        for k in range(1, window): out = np.fmin(out, self.shift(x, k))
+        return out
+
+    def rolling_max(self, x, window):
+        out = x.astype(float)
+        for k in range(1, window): out = np.fmax(out, self.shift(x, k))
+        return out
+
+    def ewm(self, x, span):
+        # 对应pandas ewm(span, adjust=False)
+        alpha = 2.0 / (span + 1)
+        out = np.empty(self.n)
+        for p in range(int(self.lengths.max()) if self.n else 0):
+            idx = self.starts[self.lengths > p] + p
+            cur = x[idx]
+            if p == 0:
+                out[idx] = cur
+                continue
+            prev = out[idx-1]
+            out[idx] = np.where(np.isnan(prev), cur, np.where(np.isnan(cur), prev, alpha*cur + (1-alpha)*prev))
+        return out
+
+    def cumsum(self, x):
+        cs = np.cumsum(x)
+        return cs - (cs[self.first] - x[self.first])
+
+# ========== 指标注册表（依赖图，按需计算） ==========
+# 名称 -> (依赖, 计算函数)；以下划线开头的是共享中间量，不作为输出列。未注册的依赖名视为行情表原始列
+INDICATORS = {}
+INDICATOR_COLUMNS = ['MA5', 'MA10', 'MA20', 'MA60', 'MACD', 'MACD_Signal', 'MACD_Hist', 'RSI',
+                     'K', 'D', 'J', 'OBV', 'Return', 'Volume_Ratio', 'Momentum']
+
+def register_indicator(name, deps, func):
+    INDICATORS[name] = (tuple(deps), func)
+
+for _w in (5, 10, 20, 60):
+    register_indicator(f'MA{_w}', ['close'], lambda c, g, w=_w: g.rolling_mean(c['close'], w))
+register_indicator('_delta', ['close'], lambda c, g: g.diff(c['close']))
+register_indicator('_ema12', ['close'], lambda c, g: g.ewm(c['close'], 12))
+register_indicator('_ema26', ['close'], lambda c, g: g.ewm(c['close'], 26))
+register_indicator('MACD', ['_ema12', '_ema26'], lambda c, g: c['_ema12'] - c['_ema26'])
+register_indicator('MACD_Signal', ['MACD'], lambda c, g: g.ewm(c['MACD'], 9))
+register_indicator('MACD_Hist', ['MACD', 'MACD_Signal'], lambda c, g: c['MACD'] - c['MACD_Signal'])
+register_indicator('_gain', ['_delta'], lambda c, g: g.rolling_mean(np.where(c['_delta'] > 0, c['_delta'], 0.0), 14))
+register_indicator('_loss', ['_delta'], lambda c, g: g.rolling_mean(np.where(c['_delta'] < 0, -c['_delta'], 0.0), 14))
+register_indicator('RSI', ['_gain', '_loss'], lambda c, g: 100 - (100 / (1 + c['_gain'] / c['_loss'])))
+register_indicator('_low_min', ['low'], lambda c, g: g.rolling_min(c['low'], 9))
+register_indicator('_high_max', ['high'], lambda c, g: g.rolling_max(c['high'], 9))
+register_indicator('K', ['close', '_low_min', '_high_max'], lambda c, g: 100 * (c['close'] - c['_low_min']) / (c['_high_max'] - c['_low_min']))
+register_indicator('D', ['K'], lambda c, g: g.rolling_mean(c['K'], 3))
+register_indicator('J', ['K', 'D'], lambda c, g: 3*c['K'] - 2*c['D'])
+register_indicator('OBV', ['_delta', 'vol'], lambda c, g: g.cumsum(np.nan_to_num(np.sign(c['_delta']) * c['vol'], nan=0.0)))
+register_indicator('Return', ['close'], lambda c, g: c['close'] / g.shift(c['close'], 1) - 1)
+register_indicator('Volume_Ratio', ['vol'], lambda c, g: c['vol'] / g.rolling_mean(c['vol'], 5))
+register_indicator('Momentum', ['close'], lambda c, g: c['close'] - g.shift(c['close'], 5))
+
+def resolve_indicators(names):
+    # 依赖优先的拓扑序，每个节点只出现一次
+    order, seen = [], set()
+    def visit(name):
+        if name in seen: return
+        seen.add(name)
+        for dep in INDICATORS.get(name, ((), None))[0]: visit(dep)
+        order.append(name)
+    for name in names: visit(name)
+    return order
+
+def compute_indicators(frame, names=None, layout=None):
+    names = INDICATOR_COLUMNS if names is None else list(names)
+    layout = layout or GroupLayout.single(len(frame))
+    ctx = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name in resolve_indicators(names):
+            if name in INDICATORS:
+                ctx[name] = INDICATORS[name][1](ctx, layout)
+            else:
+                ctx[name] = frame[name].to_numpy(dtype=float)
+    return pd.DataFrame({name: ctx[name] for name in names}, index=frame.index)
+
+def compute_indicator_columns(frame, layout):
+    return compute_indicators(frame, INDICATOR_COLUMNS, layout)
+
+def compute_universe_indicators(store):
+    layout = GroupLayout(store.starts, store.ends)
+    base = store.frame[['ts_code', 'trade_date', 'close', 'high', 'low', 'vol', 'pct_chg']]
+    return pd.concat([base, compute_indicator_columns(base, layout)], axis=1)
+
+@st.cache_resource(show_spinner=False)
+def load_indicator_table(name, signature):
+    # 全市场指标表与行情库行序一致，按源文件签名写成mmap目录，各进程共享；按代码查询只复制该股的行
+    def build():
+        store = load_price_store(name, signature)
+        if store is None: return None
+        with st.spinner('计算全市场技术指标...'):
+            return PriceStore(compute_universe_indicators(store), presorted=True).to_arrays()
+    arrays = mapped_arrays('indicators', name, signature, build)
+    return None if arrays is None else PriceStore.from_arrays(arrays)
+
+# ========== 技术指标增量更新 ==========
+# 每只股票只保留计算下一根K线所需的最小状态：MACD的EWM累加值、MA/RSI/KDJ/量比的滚动窗口、OBV累计值，
+# 新交易日到来时update()对当日所有股票一次性向量化计算，复杂度O(股票数)，结果与全量重算一致
+class IndicatorState:
+    WINDOWS = {'close': 60, 'high': 9, 'low': 9, 'vol': 5, 'gain': 14, 'loss': 14, 'K': 3}
+
+    def __init__(self, codes):
+        self.codes = pd.Index(codes)
+        n = len(self.codes)
+        self.buffers = {k: np.full((n, w), np.nan) for k, w in self.WINDOWS.items()}
+        self.ema12, self.ema26, self.signal = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+        self.obv = np.zeros(n)
+        self.last_date = None
+
+    @classmethod
+    def from_store(cls, store):
+        codes = list(store.offsets)
+        state = cls([str(c) for c in codes])
+        if not codes: return state
+        state.last_date = pd.Timestamp(store.dates.max())
+        layout = GroupLayout(store.starts, store.ends)
+        f = store.frame
+        series = {k: f[k].to_numpy(dtype=float) for k in ('close', 'high', 'low', 'vol')}
+        cols = compute_indicators(f, ['_delta', '_ema12', '_ema26', 'MACD_Signal', 'K', 'OBV'], layout)
+        delta = cols['_delta'].to_numpy()
+        series['gain'] = np.where(delta > 0, delta, 0.0)
+        series['loss'] = np.where(delta < 0, -delta, 0.0)
+        series['K'] = cols['K'].to_numpy()
+        ema12, ema26, signal, obv = (cols[k].to_numpy() for k in ('_ema12', '_ema26', 'MACD_Signal', 'OBV'))
+        last = store.ends - 1
+        for k, w in cls.WINDOWS.items():
+            idx = store.ends[:, None] - w + np.arange(w)[None, :]
+            state.buffers[k] = np.where(idx >= store.starts[:, None], series[k][np.maximum(idx, 0)], np.nan)
+        state.ema12, state.ema26, state.signal, state.obv = ema12[last], ema26[last], signal[last], obv[last]
+        return state
+
+    def _slots(self, codes):
+        codes = pd.Index(codes.astype(str))
+        new = codes.difference(self.codes)
+        if len(new):
+            self.codes = self.codes.append(new)
+            for k, w in self.WINDOWS.items():
+                self.buffers[k] = np.vstack([self.buffers[k], np.full((len(new), w), np.nan)])
+            pad = np.full(len(new), np.nan)
+            self.ema12, self.ema26, self.signal = np.r_[self.ema12, pad], np.r_[self.ema26, pad], np.r_[self.signal, pad]
+            self.obv = np.r_[self.obv, np.zeros(len(new))]
+        return self.codes.get_indexer(codes)
+
+    @staticmethod
+    def _mean(rows):
+        # 与GroupLayout.rolling_mean一致，窗口内的±inf按缺失处理
+        return np.nanmean(np.where(np.isfinite(rows), rows, np.nan), axis=1)
+
+    def _push(self, key, slots, values):
+        buf = self.buffers[key]
+        rows = buf[slots]
+        rows[:, :-1] = rows[:, 1:]
+        rows[:, -1] = values
+        buf[slots] = rows
+        return rows
+
+    def update(self, bars):
+        # bars：同一交易日的K线（每只股票一行），返回与全量指标表同列的新增行
+        slots = self._slots(bars['ts_code'].to_numpy())
+        close = bars['close'].to_numpy(dtype=float)
+        vol = bars['vol'].to_numpy(dtype=float)
+        out = {}
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            prev_close = self.buffers['close'][slots, -1]
+            delta = close - prev_close
+            closes = self._push('close', slots, close)
+            highs = self._push('high', slots, bars['high'].to_numpy(dtype=float))
+            lows = self._push('low', slots, bars['low'].to_numpy(dtype=float))
+            vols = self._push('vol', slots, vol)
+            gains = self._push('gain', slots, np.where(delta > 0, delta, 0.0))
+            losses = self._push('loss', slots, np.where(delta < 0, -delta, 0.0))
+            for w in (5, 10, 20, 60): out[f'MA{w}'] = self._mean(closes[:, -w:])
+            a12, a26, a9 = 2/13, 2/27, 2/10
+            self.ema12[slots] = np.where(np.isnan(self.ema12[slots]), close, a12*close + (1-a12)*self.ema12[slots])
+            self.ema26[slots] = np.where(np.isnan(self.ema26[slots]), close, a26*close + (1-a26)*self.ema26[slots])
+            macd = self.ema12[slots] - self.ema26[slots]
+            self.signal[slots] = np.where(np.isnan(self.signal[slots]), macd, a9*macd + (1-a9)*self.signal[slots])
+            out['MACD'], out['MACD_Signal'] = macd, self.signal[slots]
+            out['MACD_Hist'] = macd - self.signal[slots]
+            out['RSI'] = 100 - (100 / (1 + self._mean(gains) / self._mean(losses)))
+            low_min, high_max = np.nanmin(lows, axis=1), np.nanmax(highs, axis=1)
+            out['K'] = 100 * (close - low_min) / (high_max - low_min)
+            ks = self._push('K', slots, out['K'])
+            out['D'] = self._mean(ks)
+            out['J'] = 3*out['K'] - 2*out['D']
+            self.obv[slots] += np.nan_to_num(np.sign(delta) * vol, nan=0.0)
+            out['OBV'] = self.obv[slots]
+            out['Return'] = close / prev_close - 1
+            out['Volume_Ratio'] = vol / self._mean(vols)
+            out['Momentum'] = close - closes[:, -6]
+        base = bars[['ts_code', 'trade_date', 'close', 'high', 'low', 'vol', 'pct_chg']].reset_index(drop=True)
+        self.last_date = pd.Timestamp(bars['trade_date'].max())
+        return pd.concat([base, pd.DataFrame(out)], axis=1)
+
+    def save(self, path):
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                np.savez(f, codes=self.codes.to_numpy(dtype=str), ema12=self.ema12, ema26=self.ema26, signal=self.signal,
+                         obv=self.obv, last_date=np.datetime64(self.last_date, 'ns'), **{f'buf_{k}': v for k, v in self.buffers.items()})
+        return atomic_write(path, write)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            state = cls(z['codes'])
+            state.buffers = {k: z[f'buf_{k}'] for k in cls.WINDOWS}
+            state.ema12, state.ema26, state.signal, state.obv = z['ema12'], z['ema26'], z['signal'], z['obv']
+            last = pd.Timestamp(z['last_date'][()])
+            state.last_date = None if pd.isna(last) else last
+        return state
+
+# ========== 新K线追加 ==========
+# 新交易日行情追加到数据集最后一个源文件，同时用持久化的IndicatorState增量算出新增行的指标；
+# 状态文件以追加后的源文件签名命名，下次追加直接续接，无需重算全市场历史
+def indicator_state_path(name, signature):
+    return os.path.join(CACHE_DIR, f"indicator-state-{name}-{signature}.npz")
+
+def append_bars(name, bars):
+    signature = dataset_signature(name)
+    path = indicator_state_path(name, signature)
+    if os.path.exists(path):
+        state = IndicatorState.load(path)
+    else:
+        store = load_price_store(name, signature)
+        if store is None: return None
+        state = IndicatorState.from_store(store)
+    # 与读入行情库时相同的解析与降精度，新增行指标才能与重算结果一致
+    parsed = build_trade_data([bars.copy()], None)
+    keep = (parsed['trade_date'] > state.last_date).to_numpy() if state.last_date is not None else np.ones(len(bars), bool)
+    parsed, bars = parsed[keep].sort_values(['trade_date', 'ts_code'], kind='mergesort'), bars[keep]
+    if parsed.empty: return pd.DataFrame(columns=['ts_code', 'trade_date', 'close', 'high', 'low', 'vol', 'pct_chg'] + INDICATOR_COLUMNS)
+    rows = pd.concat([state.update(day) for _, day in parsed.groupby('trade_date', sort=True)], ignore_index=True)
+    target = dataset_sources(name)[-1]
+    bars.reindex(columns=pd.read_csv(target, nrows=0).columns).to_csv(target, mode='a', header=False, index=False)
+    new_path = indicator_state_path(name, dataset_signature(name))
+    if state.save(new_path): remove_stale(indicator_state_path(name, '*'), new_path)
+    return rows
+
 def calculate_cumulative_returns(df, start_date, end_date):
     if df.empty: return 0
-    mask = (df['trade_date'] >= pd.Timestamp(start_date)) & (df['trade_date'] <= pd.Timestamp(end_date))
-    filtered = df[mask]
+    filtered = TradingCalendar(df['trade_date']).slice(df, start_date, end_date)
     if len(filtered) < 2: return 0
     return (filtered.iloc[-1]['close'] / filtered.iloc[0]['close'] - 1) * 100
 
+# ========== 向量化组合回测 ==========
+# 日期×股票收盘价矩阵上按调仓日分段：段内持仓随价格漂移，段末净值=段初净值×Σw·C_t/C_调仓日，
+# 各段首尾相接一次cumprod；换手率=Σ|目标权重-漂移后权重|（成交额/净值，建仓计100%），交易成本=换手率×费率
+REBALANCE_FREQS = {'每日': 'D', '每周': 'W', '每月': 'M', '不调仓': None}
+
+def rebalance_points(dates, freq):
+    if freq is None or len(dates) == 0: return np.array([0])
+    if freq == 'D': return np.arange(len(dates))
+    keys = pd.DatetimeIndex(dates).to_period(freq).asi8
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+def portfolio_backtest(close, weights=None, freq='M', cost_bps=0.0):
+    prices = close.ffill().to_numpy(dtype=float)
+    n, m = prices.shape
+    target = np.full(m, 1.0) if weights is None else pd.Series(weights, dtype=float).reindex(close.columns).fillna(0).to_numpy()
+    points = rebalance_points(close.index, freq)
+    # 各调仓日的目标权重：当日无价格（未上市）的股票剔除后重新归一
+    held = np.where(np.isnan(prices[points]), 0.0, target)
+    totals = held.sum(axis=1, keepdims=True)
+    held = np.divide(held, totals, out=np.zeros_like(held), where=totals > 0)
+    base = np.where(np.isnan(prices[points]), 1.0, prices[points])
+    period = np.searchsorted(points, np.arange(n), 'right') - 1
+    prev = np.maximum(np.searchsorted(points, np.arange(n), 'left') - 1, 0)
+    # t为调仓日时按上一段估值（调仓前），否则按所在段估值
+    seg = np.where(np.isin(np.arange(n), points) & (np.arange(n) > 0), prev, period)
+    growth = np.nan_to_num(prices / base[seg]) * held[seg]
+    factor = growth.sum(axis=1)
+    factor[0] = 1.0
+    # 调仓前漂移权重 vs 目标权重 -> 换手与成本
+    drifted = np.zeros_like(held)
+    if len(points) > 1:
+        pre = growth[points[1:]]
+        drifted[1:] = np.divide(pre, factor[points[1:], None], out=np.zeros_like(pre), where=factor[points[1:], None] > 0)
+    turnover = np.abs(held - drifted).sum(axis=1)
+    cost = turnover * cost_bps / 1e4
+    seg_end = np.r_[factor[points[1:]], 1.0][:len(points)]
+    start_value = np.cumprod(np.r_[1.0, seg_end[:-1] * (1 - cost[1:])]) * (1 - cost[0])
+    nav = start_value[seg] * factor
+    nav[points] = start_value
+    nav = pd.Series(nav, index=close.index, name='净值')
+    drawdown = nav / nav.cummax() - 1
+    years = max((close.index[-1] - close.index[0]).days / 365.25, 1 / 365.25) if n > 1 else 1.0
+    stats = {'累计收益率': (nav.iloc[-1] - 1) * 100, '年化收益率': (nav.iloc[-1] ** (1 / years) - 1) * 100,
+             '最大回撤': drawdown.min() * 100, '调仓次数': len(points), '累计换手率': turnover.sum() * 100,
+             '交易成本': (1 - np.prod(1 - cost)) * 100}
+    return nav, stats
+
 def build_trading_strategy(predictions, prices, initial_capital=1000000):
     positions, cash, holdings = [], initial_capital, 0
     portfolio_values = []
@@ -252,20 +1225,60 @@ def build_trading_strategy(predictions, prices, initial_capital=1000000):
     total_return = (portfolio_values[-1]/initial_capital -1)*100 if portfolio_values else 0
     return {'total_return': total_return, 'portfolio_values': portfolio_values, 'positions': positions, 'final_portfolio_value': portfolio_values[-1] if portfolio_values else initial_capital}
 
-def prepare_model_data(stock_data, target_days=5):
+def pad_series(arrays, fill=np.nan):
+    # 长度不一的一维序列右侧填充成(序列数×最大长度)矩阵
+    out = np.full((len(arrays), max((len(a) for a in arrays), default=0)), fill, dtype=float)
+    for i, a in enumerate(arrays): out[i, :len(a)] = a
+    return out
+
+def batch_backtest(signals, prices, initial_capital=1000000):
+    # 批量回测：与build_trading_strategy相同的全仓买入/全部卖出规则，signals/prices为(序列数×交易日)矩阵，
+    # 逐日推进、每步对所有序列同时计算，单条序列仍用build_trading_strategy更快；
+    # 价格为NaN的位置（序列长度不一时的填充）不交易，净值记为NaN
+    signals = np.atleast_2d(np.asarray(signals))
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    n_series, n_days = prices.shape
+    cash, holdings = np.full(n_series, float(initial_capital)), np.zeros(n_series)
+    values, positions = np.full((n_series, n_days), np.nan), np.zeros((n_series, n_days))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for t in range(n_days):
+            p, s = prices[:, t], signals[:, t]
+            valid = ~np.isnan(p)
+            shares = np.where(valid & (s == 1) & (cash > 0), np.floor_divide(cash, p), 0.0)
+            cash -= np.where(shares > 0, shares * p, 0.0)
+            holdings += shares
+            sell = valid & (s == -1) & (holdings > 0)
+            cash = np.where(sell, cash + holdings * p, cash)
+            holdings = np.where(sell, 0.0, holdings)
+            values[valid, t] = cash[valid] + holdings[valid] * p[valid]
+            positions[:, t] = holdings
+    has_value = ~np.isnan(values)
+    last = n_days - 1 - np.argmax(has_value[:, ::-1], axis=1) if n_days else np.zeros(n_series, int)
+    final = np.where(has_value.any(axis=1), values[np.arange(n_series), last], initial_capital) if n_days else np.full(n_series, float(initial_capital))
+    return {'total_return': (final/initial_capital - 1)*100, 'portfolio_values': values, 'positions': positions, 'final_portfolio_value': final}
+
+FEATURE_COLS = ['MA5','MA10','MA20','MA60','MACD','RSI','K','D','J','OBV','Volume_Ratio','Momentum']
+
+def build_feature_matrix(stock_data, target_days=5, threshold=0.02):
     if stock_data.empty or len(stock_data) < 30: return None
-    stock_data = calculate_technical_indicators(stock_data)
-    feature_cols = ['MA5','MA10','MA20','MA60','MACD','RSI','K','D','J','OBV','Volume_Ratio','Momentum']
-    available = [c for c in feature_cols if c in stock_data.columns]
+    stock_data = calculate_technical_indicators(stock_data, indicators=FEATURE_COLS)
+    available = [c for c in FEATURE_COLS if c in stock_data.columns]
     if len(available) < 5: return None
     stock_data['Future_Return'] = stock_data['close'].shift(-target_days) / stock_data['close'] - 1
-    stock_data['Target'] = np.where(stock_data['Future_Return'] > 0.02, 1, np.where(stock_data['Future_Return'] < -0.02, -1, 0))
+    future = stock_data['Future_Return']
+    # 末尾target_days行没有未来价格，标签记为缺失后剔除，而不是当作"震荡"
+    stock_data['Target'] = np.where(future > threshold, 1, np.where(future < -threshold, -1, np.where(future.isna(), np.nan, 0)))
     stock_data = stock_data.dropna(subset=available+['Target'])
+    stock_data['Target'] = stock_data['Target'].astype(int)
     if len(stock_data) < 50: return None
-    X = stock_data[available]
-    y = stock_data['Target']
-    train_size = int(0.7*len(X))
-    val_size = int(0.15*len(X))
+    return stock_data[available], stock_data['Target'], available
+
+def prepare_model_data(stock_data, target_days=5, threshold=0.02, test_ratio=0.15, val_ratio=0.15):
+    res = build_feature_matrix(stock_data, target_days, threshold)
+    if res is None: return None
+    X, y, available = res
+    train_size = int(round(1 - val_ratio - test_ratio, 6)*len(X))
+    val_size = int(val_ratio*len(X))
     X_train, X_val, X_test = X[:train_size], X[train_size:train_size+val_size], X[train_size+val_size:]
     y_train, y_val, y_test = y[:train_size], y[train_size:train_size+val_size], y[train_size+val_size:]
     scaler = StandardScaler()
@@ -285,36 +1298,487 @@ def train_model(model_type, X_train, y_train, X_val, y_val):
     val_acc = accuracy_score(y_val, model.predict(X_val))
     return model, val_acc
 
-def generate_ai_analysis(stock_data, industry_name, stock_code, analysis_year, api_key):
+# ========== 模型磁盘缓存 ==========
+# 训练结果（模型、StandardScaler、特征列表、验证集准确率）按"数据切片哈希+超参数"写入磁盘，跨会话与重启复用；
+# 总大小超过MODEL_CACHE_MAX_MB时按最近使用时间淘汰
+MODEL_CACHE_DIR = os.path.join(CACHE_DIR, 'models')
+MODEL_CACHE_MAX_MB = float(os.environ.get("MODEL_CACHE_MAX_MB", 512))
+MODEL_CACHE_VERSION = "2"  # 特征或标签构造变化时递增，使旧模型失效
+
+def model_cache_key(stock_data, params):
+    h = hashlib.sha256(pd.util.hash_pandas_object(stock_data, index=False).to_numpy().tobytes())
+    h.update(json.dumps({**params, 'sklearn': sklearn.__version__, 'version': MODEL_CACHE_VERSION}, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+def load_cached_model(key):
+    path = os.path.join(MODEL_CACHE_DIR, f"{key}.pkl")
+    if not os.path.exists(path): return None
+    try:
+        with open(path, 'rb') as f: entry = pickle.load(f)
+        os.utime(path)  # 记录最近使用
+        return entry
+    except Exception:
+        try: os.remove(path)
+        except OSError: pass
+        return None
+
+def save_cached_model(key, entry):
+    def write(tmp):
+        with open(tmp, 'wb') as f: pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    if atomic_write(os.path.join(MODEL_CACHE_DIR, f"{key}.pkl"), write): evict_model_cache()
+
+def evict_model_cache(max_bytes=None):
+    evict_lru(os.path.join(MODEL_CACHE_DIR, '*.pkl'), MODEL_CACHE_MAX_MB * 2**20 if max_bytes is None else max_bytes)
+
+def evict_lru(pattern, max_bytes):
+    # 按最近使用时间(mtime)从旧到新删除，直到总大小不超过max_bytes
+    files = []
+    for p in glob.glob(pattern):
+        try: files.append((os.stat(p).st_mtime, os.path.getsize(p), p))
+        except OSError: pass
+    total = sum(size for _, size, _ in files)
+    for _, size, p in sorted(files):
+        if total <= max_bytes: break
+        try: os.remove(p)
+        except OSError: pass
+        total -= size
+
+def train_model_cached(model_type, stock_data, target_days=5, threshold=0.02, test_ratio=0.15, use_cache=True):
+    # 返回(缓存条目, prepare_model_data结果)；数据准备很快，只有拟合被缓存。use_cache=False时不读写磁盘缓存
+    res = prepare_model_data(stock_data, target_days=target_days, threshold=threshold, test_ratio=test_ratio)
+    if not res: return None
+    X_train,y_train,X_val,y_val,X_test,y_test,scaler,feats = res
+    key = model_cache_key(stock_data, {'model': model_type, 'target_days': target_days, 'threshold': threshold,
+                                       'test_ratio': test_ratio, 'features': feats}) if use_cache else None
+    entry = load_cached_model(key) if use_cache else None
+    if entry is None:
+        model, val_acc = train_model(model_type, X_train, y_train, X_val, y_val)
+        entry = {'model': model, 'scaler': scaler, 'features': feats, 'val_acc': val_acc}
+        if use_cache: save_cached_model(key, entry)
+    return entry, res
+
+# ========== 行业合并模型 ==========
+# 同一申万行业全部股票的特征在分组布局上一次性向量化计算，按交易日（而非行）做时间切分后训练一个合并模型，
+# 行业内任一股票都由该模型给出预测；拟合结果经模型磁盘缓存复用，每个行业/年度/参数组合只训练一次
+def build_pooled_features(store, stocks, year, target_days=5, threshold=0.02):
+    parts = [store.get_history(code, date(year,1,1), date(year,12,31)) for code in stocks]
+    parts = [p for p in parts if len(p) >= 30]
+    if not parts: return None
+    frame = pd.concat(parts, ignore_index=True)
+    lengths = np.array([len(p) for p in parts])
+    ends = np.cumsum(lengths)
+    layout = GroupLayout(ends - lengths, ends)
+    close = frame['close'].to_numpy(dtype=float)
+    pooled = pd.concat([frame[['ts_code', 'trade_date', 'close']], compute_indicators(frame, FEATURE_COLS, layout)], axis=1)
+    future = layout.lead(close, target_days) / close - 1
+    target = np.where(future > threshold, 1, np.where(future < -threshold, -1, 0)).astype(float)
+    target[np.isnan(future)] = np.nan
+    pooled['Target'] = target
+    # 标签所用未来收盘价的日期，用于在时间切分处剔除标签跨越切分点的样本
+    days = frame['trade_date'].to_numpy().astype('datetime64[D]').astype(float)
+    pooled['Target_Date'] = pd.to_datetime(layout.lead(days, target_days), unit='D')
+    return pooled.dropna(subset=FEATURE_COLS).reset_index(drop=True)
+
+def train_pooled_model(store, stocks, year, model_type, target_days=5, threshold=0.02, test_ratio=0.15, val_ratio=0.15):
+    pooled = build_pooled_features(store, stocks, year, target_days, threshold)
+    if pooled is None: return None
+    labeled = pooled.dropna(subset=['Target'])
+    if len(labeled) < 50: return None
+    dates = np.sort(labeled['trade_date'].unique())
+    train_end = dates[min(int(round(1 - val_ratio - test_ratio, 6) * len(dates)), len(dates)-1)]
+    test_start = dates[min(int((1 - test_ratio) * len(dates)), len(dates)-1)]
+    # 清除(purge)：训练/验证样本的标签必须在下一段开始之前就已确定，否则会用到下一段的价格
+    train = labeled[labeled['Target_Date'] < train_end]
+    val = labeled[(labeled['trade_date'] >= train_end) & (labeled['Target_Date'] < test_start)]
+    test = labeled[labeled['trade_date'] >= test_start]
+    key = model_cache_key(labeled, {'model': model_type, 'pooled': True, 'year': year, 'target_days': target_days,
+                                    'threshold': threshold, 'test_ratio': test_ratio, 'features': FEATURE_COLS})
+    entry = load_cached_model(key)
+    if entry is None:
+        scaler = StandardScaler().fit(train[FEATURE_COLS])
+        model, val_acc = train_model(model_type, scaler.transform(train[FEATURE_COLS]), train['Target'].astype(int),
+                                     scaler.transform(val[FEATURE_COLS]), val['Target'].astype(int))
+        test_acc = accuracy_score(test['Target'].astype(int), model.predict(scaler.transform(test[FEATURE_COLS]))) if len(test) else np.nan
+        entry = {'model': model, 'scaler': scaler, 'features': FEATURE_COLS, 'val_acc': val_acc, 'test_acc': test_acc,
+                 'test_start': test_start, 'n_stocks': labeled['ts_code'].nunique(), 'n_rows': len(labeled)}
+        save_cached_model(key, entry)
+    return entry, pooled
+
+def pooled_stock_predictions(entry, pooled, code):
+    rows = pooled[pooled['ts_code'] == code]
+    if rows.empty: return rows, np.array([])
+    return rows, entry['model'].predict(entry['scaler'].transform(rows[entry['features']]))
+
+def strategy_inputs(model, scaler, feats, stock_data):
+    # 用训练好的模型对全部有效交易日给出信号，返回(信号, 收盘价)
+    tech = calculate_technical_indicators(stock_data, indicators=feats)
+    valid = tech[feats].dropna()
+    if valid.empty: return None
+    return model.predict(scaler.transform(valid)), tech.loc[valid.index, 'close'].values
+
+def evaluate_strategy(model, scaler, feats, stock_data):
+    inputs = strategy_inputs(model, scaler, feats, stock_data)
+    return build_trading_strategy(*inputs) if inputs else None
+
+def pooled_strategy_returns(entry, pooled):
+    # 合并模型对行业内全部股票一次预测，再用batch_backtest同时回测，返回各股策略收益率(%)
+    pred = entry['model'].predict(entry['scaler'].transform(pooled[entry['features']]))
+    codes = pooled['ts_code'].astype(str).to_numpy()
+    starts = np.r_[0, np.flatnonzero(codes[1:] != codes[:-1]) + 1]
+    ends = np.r_[starts[1:], len(codes)]
+    close = pooled['close'].to_numpy(dtype=float)
+    res = batch_backtest(pad_series([pred[s:e] for s, e in zip(starts, ends)], 0),
+                         pad_series([close[s:e] for s, e in zip(starts, ends)]))
+    return pd.Series(res['total_return'], index=pd.Index(codes[starts], name='ts_code'), name='策略收益率(%)')
+
+# ========== 参数批量扫描 ==========
+# 股票×模型×预测天数×标签阈值的网格在进程池中并行执行，结果写入CACHE_DIR/sweeps供排序和作图；
+# 扫描的拟合结果只用一次，不进模型磁盘缓存，以免成千上万个条目挤掉交互训练的缓存、多进程反复扫描目录做淘汰
+MODEL_TYPES = ['逻辑回归', '支持向量机', '随机森林', '梯度提升树', '神经网络']
+MODEL_WORKERS = int(os.environ.get("MODEL_WORKERS", os.cpu_count() or 1))
+
+@pool_tasks.task
+def run_sweep_task(task):
+    code, stock_data, model_type, target_days, threshold = task
+    row = {'股票代码': code, '模型': model_type, '预测天数': target_days, '标签阈值': threshold}
+    try:
+        trained = train_model_cached(model_type, stock_data, target_days=target_days, threshold=threshold, use_cache=False)
+        if not trained: return {**row, '状态': '数据不足'}
+        entry, (X_train,y_train,X_val,y_val,X_test,y_test,scaler,feats) = trained
+        model, val_acc = entry['model'], entry['val_acc']
+        test_acc = accuracy_score(y_test, model.predict(X_test))
+        # 策略回测留给run_parameter_sweep用batch_backtest对所有网格单元一次完成
+        inputs = strategy_inputs(model, scaler, feats, stock_data)
+        return {**row, '验证集准确率': val_acc, '测试集准确率': test_acc, '_inputs': inputs, '状态': '完成'}
+    except Exception as e:
+        return {**row, '状态': f'失败: {e}'}
+
+def run_parameter_sweep(store, stocks, year, model_types, target_days_list, thresholds, workers=None):
+    histories = {code: store.get_history(code, date(year,1,1), date(year,12,31)) for code in stocks}
+    tasks = [(code, histories[code], m, d, th) for code, m, d, th in itertools.product(stocks, model_types, target_days_list, thresholds)
+             if not histories[code].empty]
+    workers = min(workers or MODEL_WORKERS, max(len(tasks), 1))
+    if workers <= 1:
+        rows = [run_sweep_task(t) for t in tasks]
+    else:
+        with make_executor('process', workers) as ex:
+            rows = list(ex.map(pool_tasks.bind(run_sweep_task), tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    inputs = [r.pop('_inputs', None) for r in rows]
+    done = [i for i, x in enumerate(inputs) if x is not None]
+    returns = np.full(len(rows), np.nan)
+    if done:
+        returns[done] = batch_backtest(pad_series([inputs[i][0] for i in done], 0), pad_series([inputs[i][1] for i in done]))['total_return']
+    results = pd.DataFrame(rows)
+    if not results.empty:
+        results.insert(results.columns.get_loc('状态'), '策略收益率(%)', returns)
+        results.insert(0, '年度', year)
+        atomic_write(os.path.join(CACHE_DIR, 'sweeps', f"sweep-{year}-{datetime.now():%Y%m%d-%H%M%S}.csv"),
+                     lambda tmp: results.to_csv(tmp, index=False, encoding='utf-8-sig'))
+    return results
+
+# ========== 滚动前推验证 ==========
+# 扩展窗口：样本按时间分为n_folds+1段，第k折用前k段训练、第k+1段检验，各折在进程池中并行训练。
+# 训练段末尾target_days行的标签取自检验段的价格，训练前剔除(purge)；
+# 特征矩阵只计算一次；各折标准化参数由累计和/平方累计和直接得到，无需逐折重新拟合StandardScaler
+@pool_tasks.task
+def run_fold_task(task):
+    fold, model_type, X_train, y_train, X_test, y_test = task
+    model, acc = train_model(model_type, X_train, y_train, X_test, y_test)
+    return fold, acc
+
+def walk_forward_evaluate(stock_data, model_type, target_days=5, threshold=0.02, n_folds=5, workers=None):
+    res = build_feature_matrix(stock_data, target_days, threshold)
+    if res is None: return None
+    X_df, y, _ = res
+    X, y_arr = X_df.to_numpy(dtype=float), y.to_numpy()
+    bounds = np.linspace(0, len(X), n_folds + 2).astype(int)
+    shift = X[0]
+    cs1, cs2 = np.cumsum(X - shift, axis=0), np.cumsum((X - shift) ** 2, axis=0)
+    tasks, rows = [], []
+    if bounds[1] - target_days < 2: return None
+    for k in range(1, n_folds + 1):
+        train_end, test_end = bounds[k], bounds[k+1]
+        fit_end = train_end - target_days
+        mean = cs1[fit_end-1] / fit_end
+        scale = np.sqrt(np.maximum(cs2[fit_end-1] / fit_end - mean ** 2, 0))
+        scale[scale == 0] = 1.0
+        Xs = (X[:test_end] - shift - mean) / scale
+        tasks.append((k, model_type, Xs[:fit_end], y_arr[:fit_end], Xs[train_end:], y_arr[train_end:test_end]))
+        rows.append({'折': k, '训练样本': fit_end, '检验样本': test_end - train_end,
+                     '检验起始': X_df.index[train_end], '检验结束': X_df.index[test_end-1]})
+    workers = min(workers or MODEL_WORKERS, n_folds)
+    try:
+        if workers <= 1:
+            accs = dict(run_fold_task(t) for t in tasks)
+        else:
+            with make_executor('process', workers) as ex:
+                accs = dict(ex.map(pool_tasks.bind(run_fold_task), tasks))
+    except ValueError:
+        return None  # 某折训练集只含一个类别
+    folds = pd.DataFrame(rows)
+    folds['准确率'] = folds['折'].map(accs)
+    dates = stock_data['trade_date']
+    folds['检验起始'] = dates.loc[folds['检验起始']].dt.date.values
+    folds['检验结束'] = dates.loc[folds['检验结束']].dt.date.values
+    summary = {'平均准确率': folds['准确率'].mean(), '准确率标准差': folds['准确率'].std(ddof=0),
+               '加权准确率': np.average(folds['准确率'], weights=folds['检验样本'])}
+    return folds, summary
+
+# ========== 大模型调用与响应缓存 ==========
+# 以(接口地址, 模型, 消息, 采样参数)的哈希为键把回复写入磁盘，所有会话共享；超过LLM_CACHE_TTL秒视为过期，
+# 总大小超过LLM_CACHE_MAX_MB按最近使用淘汰。调用失败不缓存。LLM_BASE_URL可指向本地兼容OpenAI的桩服务用于测试
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://api.deepseek.com")
+LLM_MODEL = os.environ.get("LLM_MODEL", "deepseek-chat")
+LLM_CACHE_DIR = os.path.join(CACHE_DIR, 'llm')
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 24 * 3600))
+LLM_CACHE_MAX_MB = float(os.environ.get("LLM_CACHE_MAX_MB", 64))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 4))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+
+def llm_cache_key(messages, params):
+    payload = {'base_url': LLM_BASE_URL, 'model': LLM_MODEL, 'messages': messages, **params}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def load_cached_reply(key):
+    path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, encoding='utf-8') as f: entry = json.load(f)
+        if time.time() - entry['created'] > LLM_CACHE_TTL:
+            os.remove(path)
+            return None
+        os.utime(path)  # 记录最近使用
+        return entry['reply']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_cached_reply(key, reply):
+    def write(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump({'created': time.time(), 'reply': reply}, f, ensure_ascii=False)
+    if atomic_write(os.path.join(LLM_CACHE_DIR, f"{key}.json"), write):
+        evict_lru(os.path.join(LLM_CACHE_DIR, '*.json'), LLM_CACHE_MAX_MB * 2**20)
+
+# 进程内所有会话共享：每个API密钥一个保持长连接的客户端（失败按指数退避重试），并发请求数由同一个信号量限制
+@st.cache_resource(show_spinner=False)
+def get_llm_client(api_key, base_url):
+    limits = httpx.Limits(max_connections=LLM_MAX_CONCURRENCY, max_keepalive_connections=LLM_MAX_CONCURRENCY)
+    http_client = httpx.Client(limits=limits, timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0))
+    return OpenAI(api_key=api_key, base_url=base_url, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES, http_client=http_client)
+
+# 同步调用方阻塞等待；异步调用方await一个Future，由释放方跨线程唤醒，不占线程也不轮询
+class ConcurrencyLimiter:
+    def __init__(self, limit):
+        self.limit = limit
+        self._free = limit
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()  # threading.Event 或 [loop, future, 已分配]
+
+    def acquire(self):
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return
+            waiter = [loop, loop.create_future(), False]
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            # 取消与分配竞争时，已分到的名额要还回去
+            with self._lock:
+                granted = waiter[2]
+                if not granted: self._waiters.remove(waiter)
+            if granted: self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            self._free += 1
+            while self._free and self._waiters:
+                waiter = self._waiters.popleft()
+                self._free -= 1
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    continue
+                waiter[2] = True
+                try:
+                    waiter[0].call_soon_threadsafe(lambda fut=waiter[1]: fut.done() or fut.set_result(None))
+                except RuntimeError:  # 等待方的事件循环已关闭
+                    self._free += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+@st.cache_resource(show_spinner=False)
+def llm_limiter():
+    return ConcurrencyLimiter(LLM_MAX_CONCURRENCY)
+
+def _chat_completion(messages, api_key, temperature=0.7, max_tokens=2000):
+    params = {'temperature': temperature, 'max_tokens': max_tokens}
+    key = llm_cache_key(messages, params)
+    reply = load_cached_reply(key)
+    if reply is None:
+        with llm_limiter():
+            response = get_llm_client(api_key, LLM_BASE_URL).chat.completions.create(model=LLM_MODEL, messages=messages, **params)
+        reply = response.choices[0].message.content
+        if reply: save_cached_reply(key, reply)
+    return reply
+
+def _chat_stream(messages, api_key, temperature=0.7, max_tokens=2000):
+    # 逐段产出回复文本；命中缓存时一次产出全文，完整收到后才写入缓存
+    params = {'temperature': temperature, 'max_tokens': max_tokens}
+    key = llm_cache_key(messages, params)
+    reply = load_cached_reply(key)
+    if reply is not None:
+        yield reply
+        return
+    parts = []
+    with llm_limiter():
+        stream = get_llm_client(api_key, LLM_BASE_URL).chat.completions.create(model=LLM_MODEL, messages=messages, stream=True, **params)
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    if parts: save_cached_reply(key, "".join(parts))
+
+def render_stream(chunks, placeholder, fmt="{}"):
+    # 边接收边刷新占位元素，末尾光标表示仍在生成
+    text = ""
+    for delta in chunks:
+        text += delta
+        placeholder.markdown(fmt.format(text + "▌"), unsafe_allow_html=True)
+    placeholder.markdown(fmt.format(text), unsafe_allow_html=True)
+    return text
+
+def build_analysis_messages(industry_name, stock_code, analysis_year, inputs):
+    # 单股报告与行业批量报告共用，提示词逐字一致才能共享响应缓存
+    prompt = f"""你是一位资深金融分析师，请对{industry_name}行业的股票{stock_code}（年份：{analysis_year}）进行分析。
+数据：价格{inputs['close']:.2f}，涨跌幅{inputs['pct_chg']:.2f}%，成交量{inputs['avg_vol']:.0f}；RSI={inputs['RSI']:.1f}，MACD={inputs['MACD']:.3f}，信号线={inputs['MACD_Signal']:.3f}。
+请给出技术分析、市场环境、投资建议和风险提示。"""
+    return [{"role":"system","content":"你是专业金融分析师。"},{"role":"user","content":prompt}]
+
+def generate_ai_analysis(stock_data, industry_name, stock_code, analysis_year, api_key, placeholder=None):
     if not api_key: return "请输入API密钥"
     try:
         latest = stock_data.tail(50)
-        current_price = latest['close'].iloc[-1] if len(latest)>0 else 0
-        price_change = latest['pct_chg'].iloc[-1] if len(latest)>0 else 0
-        avg_volume = latest['vol'].mean() if len(latest)>0 else 0
-        tech = calculate_technical_indicators(stock_data.copy())
-        if not tech.empty:
-            rsi = tech.iloc[-1].get('RSI',50)
-            macd = tech.iloc[-1].get('MACD',0)
-            macd_signal = tech.iloc[-1].get('MACD_Signal',0)
-        else: rsi,macd,macd_signal = 50,0,0
-        prompt = f"""你是一位资深金融分析师，请对{industry_name}行业的股票{stock_code}（年份：{analysis_year}）进行分析。
-数据：价格{current_price:.2f}，涨跌幅{price_change:.2f}%，成交量{avg_volume:.0f}；RSI={rsi:.1f}，MACD={macd:.3f}，信号线={macd_signal:.3f}。
-请给出技术分析、市场环境、投资建议和风险提示。"""
-        client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
-        response = client.chat.completions.create(model="deepseek-chat", messages=[{"role":"system","content":"你是专业金融分析师。"},{"role":"user","content":prompt}], temperature=0.7, max_tokens=1500)
-        return response.choices[0].message.content
+        tech = calculate_technical_indicators(stock_data, indicators=['RSI', 'MACD', 'MACD_Signal'])
+        inputs = {'close': latest['close'].iloc[-1] if len(latest)>0 else 0,
+                  'pct_chg': latest['pct_chg'].iloc[-1] if len(latest)>0 else 0,
+                  'avg_vol': latest['vol'].astype(float).mean() if len(latest)>0 else 0,
+                  'RSI': tech.iloc[-1].get('RSI',50) if not tech.empty else 50,
+                  'MACD': tech.iloc[-1].get('MACD',0) if not tech.empty else 0,
+                  'MACD_Signal': tech.iloc[-1].get('MACD_Signal',0) if not tech.empty else 0}
+        messages = build_analysis_messages(industry_name, stock_code, analysis_year, inputs)
+        if placeholder is not None:
+            return render_stream(_chat_stream(messages, api_key, max_tokens=1500), placeholder)
+        return _chat_completion(messages, api_key, max_tokens=1500)
     except Exception as e: return f"AI分析失败: {e}"
 
+# ========== 行业批量AI报告 ==========
+# 提示词输入一次向量化算出（各股年度切片拼接后按GroupLayout算指标，取每组末行），请求用asyncio并发发出：
+# 本批次的asyncio信号量与进程级并发上限同时生效；结果按"行业-年度"写入CACHE_DIR/reports供浏览
+REPORT_DIR = os.path.join(CACHE_DIR, 'reports')
+
+def analysis_inputs(store, stocks, year):
+    parts = [store.get_history(code, date(year,1,1), date(year,12,31)) for code in stocks]
+    parts = [p for p in parts if len(p) > 0]
+    if not parts: return pd.DataFrame()
+    frame = pd.concat(parts, ignore_index=True)
+    lengths = np.array([len(p) for p in parts])
+    ends = np.cumsum(lengths)
+    layout = GroupLayout(ends - lengths, ends)
+    tech = compute_indicators(frame, ['RSI', 'MACD', 'MACD_Signal'], layout)
+    last = ends - 1
+    # 末50个交易日平均成交量
+    vol_cs = np.r_[0, np.cumsum(frame['vol'].to_numpy(dtype=float))]
+    window = np.minimum(lengths, 50)
+    # 与calculate_technical_indicators一致：不足30个交易日不计算指标，取RSI=50、MACD=0的默认值
+    short = lengths < 30
+    return pd.DataFrame({'close': frame['close'].to_numpy(dtype=float)[last], 'pct_chg': frame['pct_chg'].to_numpy(dtype=float)[last],
+                         'avg_vol': (vol_cs[ends] - vol_cs[ends - window]) / window,
+                         'RSI': np.where(short, 50.0, tech['RSI'].to_numpy()[last]),
+                         'MACD': np.where(short, 0.0, tech['MACD'].to_numpy()[last]),
+                         'MACD_Signal': np.where(short, 0.0, tech['MACD_Signal'].to_numpy()[last])},
+                        index=pd.Index([str(p['ts_code'].iloc[0]) for p in parts], name='ts_code'))
+
+async def _chat_completion_async(client, semaphore, messages, temperature=0.7, max_tokens=1500):
+    params = {'temperature': temperature, 'max_tokens': max_tokens}
+    key = llm_cache_key(messages, params)
+    reply = load_cached_reply(key)
+    if reply is not None: return reply
+    async with semaphore, llm_limiter():
+        response = await client.chat.completions.create(model=LLM_MODEL, messages=messages, **params)
+    reply = response.choices[0].message.content
+    if reply: save_cached_reply(key, reply)
+    return reply
+
+async def _generate_reports(inputs, industry_name, year, api_key, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    # AsyncOpenAI绑定事件循环，每批新建一个
+    async with AsyncOpenAI(api_key=api_key, base_url=LLM_BASE_URL, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES) as client:
+        async def one(code, row):
+            try:
+                return code, await _chat_completion_async(client, semaphore, build_analysis_messages(industry_name, code, year, row)), None
+            except Exception as e:
+                return code, None, str(e)
+        return await asyncio.gather(*(one(code, row) for code, row in inputs.iterrows()))
+
+# 批量请求同样受进程级上限约束，超出的并发数只会排队，因此直接收敛到上限并记录实际值
+def effective_concurrency(requested=None):
+    return max(1, min(requested or LLM_MAX_CONCURRENCY, LLM_MAX_CONCURRENCY))
+
+def generate_industry_reports(store, stocks, industry_name, year, api_key, concurrency=None):
+    inputs = analysis_inputs(store, stocks, year)
+    if inputs.empty: return None
+    concurrency = effective_concurrency(concurrency)
+    results = asyncio.run(_generate_reports(inputs, industry_name, year, api_key, concurrency))
+    batch = {'industry': industry_name, 'year': year, 'model': LLM_MODEL, 'concurrency': concurrency,
+             'created': datetime.now().isoformat(timespec='seconds'),
+             'reports': [{'ts_code': code, 'report': report, 'error': error} for code, report, error in results]}
+    def write(tmp):
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump(batch, f, ensure_ascii=False, indent=1)
+    atomic_write(os.path.join(REPORT_DIR, f"{industry_name}-{year}.json"), write)
+    return batch
+
+def list_report_batches():
+    return sorted(glob.glob(os.path.join(REPORT_DIR, '*.json')), key=os.path.getmtime, reverse=True)
+
+def load_report_batch(path):
+    try:
+        with open(path, encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
 # ========== AI对话上下文（全局） ==========
 def get_current_context(data, module, industry_name=None, stock_code=None):
     if module == "市场总览":
-        trade = data.get('trade_data', pd.DataFrame())
+        latest = data.market_summary().latest()
         hs = data.get('hs300_data', pd.DataFrame())
         ind = data.get('industry_info', pd.DataFrame())
         ctx = ""
-        if not trade.empty:
-            ctx += f"最新交易日平均涨跌幅：{trade.groupby('trade_date')['pct_chg'].mean().iloc[-1]:.2f}% "
+        if latest is not None:
+            ctx += f"最新交易日平均涨跌幅：{latest['mean_pct']:.2f}%，上涨{int(latest['advancers'])}家、下跌{int(latest['decliners'])}家 "
         if not hs.empty:
             ctx += f"沪深300收盘{hs['close'].iloc[-1]:.2f} "
         if not ind.empty:
@@ -323,12 +1787,10 @@ def get_current_context(data, module, industry_name=None, stock_code=None):
     elif module == "行业分析" and industry_name:
         info = data.get('industry_info', pd.DataFrame())
         stocks = info[info['新版一级行业']==industry_name]['股票代码'].tolist()
-        adj = data.get('adj_trade_data', pd.DataFrame())
         ctx = f"行业：{industry_name}，共{len(stocks)}只股票。"
-        if not adj.empty:
-            latest = adj[adj['ts_code'].isin(stocks) & (adj['trade_date']==adj['trade_date'].max())]
-            if not latest.empty:
-                ctx += f"最近交易日平均涨跌幅：{latest['pct_chg'].mean():.2f}%。"
+        latest = data.market_summary().industry_latest(industry_name)
+        if latest is not None:
+            ctx += f"最近交易日平均涨跌幅：{latest['pct_chg']:.2f}%。"
         return ctx
     elif module == "个股分析":
         return f"个股分析，当前查看股票：{stock_code if stock_code else '未选择'}。"
@@ -336,13 +1798,64 @@ def get_current_context(data, module, industry_name=None, stock_code=None):
         return "投资组合回测，可构建等权组合并计算净值。"
     return "金融数据平台。"
 
-def call_chat_api(messages, api_key):
+def call_chat_api(messages, api_key, placeholder=None, fmt="{}"):
     try:
-        client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
-        response = client.chat.completions.create(model="deepseek-chat", messages=messages, temperature=0.7, max_tokens=2000)
-        return response.choices[0].message.content
+        if placeholder is not None:
+            return render_stream(_chat_stream(messages, api_key, max_tokens=2000), placeholder, fmt)
+        return _chat_completion(messages, api_key, max_tokens=2000)
     except Exception as e: return f"调用失败: {e}"
 
+# ========== 对话历史的token预算 ==========
+# 最近几轮原文保留；超出CHAT_TOKEN_BUDGET时把较早的消息折叠进会话内的滚动摘要（一次折叠到预算一半，避免每轮都总结），
+# 摘要调用失败时退化为截取各条消息开头拼接
+CHAT_TOKEN_BUDGET = int(os.environ.get("CHAT_TOKEN_BUDGET", 3000))
+CHAT_SUMMARY_TOKENS = CHAT_TOKEN_BUDGET // 4
+
+def estimate_tokens(text):
+    # 粗略估计：中日韩字符约1个token，其余约4个字符1个token，每条消息另加4个格式开销
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uff00' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4 + 4
+
+def recent_start(history, budget):
+    # 从最新一条往前累加，返回预算内可保留的最早位置（至少保留最后一条），并对齐到用户消息
+    used, start = 0, len(history)
+    while start > 0:
+        cost = estimate_tokens(history[start-1]['content'])
+        if used + cost > budget and start < len(history): break
+        used += cost
+        start -= 1
+    while start < len(history) - 1 and history[start]['role'] != 'user': start += 1
+    return start
+
+def fallback_summary(summary, messages):
+    lines = [f"{'用户' if m['role']=='user' else '助手'}：{m['content'][:60]}" for m in messages]
+    text = "；".join(([summary] if summary else []) + lines)
+    return text[-CHAT_SUMMARY_TOKENS:]  # 按每字约1个token截取最新部分
+
+def summarize_chat(summary, messages, api_key):
+    transcript = "\n".join(f"{'用户' if m['role']=='user' else '助手'}：{m['content']}" for m in messages)
+    prompt = (f"已有摘要：{summary or '无'}\n新增对话：\n{transcript}\n"
+              f"请将已有摘要与新增对话合并为一段不超过{CHAT_SUMMARY_TOKENS // 2}字的中文摘要，保留涉及的股票、行业、数值和结论。")
+    try:
+        text = _chat_completion([{"role": "user", "content": prompt}], api_key, temperature=0.2, max_tokens=CHAT_SUMMARY_TOKENS)
+        if text and estimate_tokens(text) <= CHAT_SUMMARY_TOKENS * 2: return text
+    except Exception:
+        pass
+    return fallback_summary(summary, messages)
+
+def budget_chat_messages(system, api_key):
+    # 返回本轮请求的消息列表；折叠进度(chat_folded)与摘要(chat_summary)保存在session_state
+    history = st.session_state.chat_messages
+    folded = st.session_state.get('chat_folded', 0)
+    summary = st.session_state.get('chat_summary', '')
+    budget = CHAT_TOKEN_BUDGET - estimate_tokens(system) - CHAT_SUMMARY_TOKENS
+    if recent_start(history, budget) > folded:
+        start = max(recent_start(history, budget // 2), folded)
+        summary, folded = summarize_chat(summary, history[folded:start], api_key), start
+        st.session_state.chat_summary, st.session_state.chat_folded = summary, folded
+    if summary: system += f"\n此前对话摘要：{summary}"
+    return [{"role": "system", "content": system}] + history[folded:]
+
 def render_global_chat(data, module, industry_name=None, stock_code=None):
     st.sidebar.markdown("---")
     st.sidebar.markdown("### 💬 智能金融助手")
@@ -355,53 +1868,53 @@ def render_global_chat(data, module, industry_name=None, stock_code=None):
     user_input = st.sidebar.chat_input("提问金融问题...")
     if user_input:
         st.session_state.chat_messages.append({"role": "user", "content": user_input})
+        st.sidebar.markdown(f'<div class="chat-message chat-user">👤 {user_input}</div>', unsafe_allow_html=True)
         context = get_current_context(data, module, industry_name, stock_code)
         system = f"你是金融分析师，当前上下文：{context}。请基于此回答，超出使用通用知识。"
-        messages = [{"role": "system", "content": system}] + st.session_state.chat_messages
-        with st.spinner("思考中..."):
-            reply = call_chat_api(messages, st.session_state.get('api_key', ''))
+        messages = budget_chat_messages(system, st.session_state.get('api_key', ''))
+        bubble = st.sidebar.empty()
+        bubble.markdown('<div class="chat-message chat-assistant">🤖 思考中...</div>', unsafe_allow_html=True)
+        reply = call_chat_api(messages, st.session_state.get('api_key', ''), bubble, '<div class="chat-message chat-assistant">🤖 {}</div>')
+        if reply.startswith("调用失败"):
+            bubble.markdown(f'<div class="chat-message chat-assistant">🤖 {reply}</div>', unsafe_allow_html=True)
         st.session_state.chat_messages.append({"role": "assistant", "content": reply})
         st.rerun()
 
 # ========== 功能模块 ==========
+@uses_datasets('hs300_data', 'market_summary', 'financials')
 def display_market_overview(data):
     st.markdown('<h1 class="main-header">📊 市场总览</h1>', unsafe_allow_html=True)
-    trade = data.get('trade_data', pd.DataFrame())
+    summary = data.market_summary()
     hs300 = data.get('hs300_data', pd.DataFrame())
-    index_data = data.get('index_data', pd.DataFrame())
-    stock_basic = data.get('stock_basic', pd.DataFrame())
-    industry_info = data.get('industry_info', pd.DataFrame())
-    fin = data.get('financial_data', pd.DataFrame())
+    financials = data.financials()
     col1, col2 = st.columns([1,2])
     with col1:
         start = st.date_input("开始日期", date(2024,1,1), key="mark_start")
         end = st.date_input("结束日期", date(2024,12,31), key="mark_end")
-        if not trade.empty:
-            latest = trade['trade_date'].max()
-            recent = trade[trade['trade_date']==latest]
-            st.metric("交易股票数", len(recent))
-            st.metric("平均涨跌幅", f"{recent['pct_chg'].mean():.2f}%")
-            st.metric("总成交量(亿)", f"{recent['vol'].sum()/1e8:.1f}")
+        latest = summary.latest()
+        if latest is not None:
+            st.metric("交易股票数", int(latest['stocks']))
+            st.metric("平均涨跌幅", f"{latest['mean_pct']:.2f}%")
+            st.metric("上涨/下跌家数", f"{int(latest['advancers'])}/{int(latest['decliners'])}")
+            st.metric("总成交量(亿)", f"{latest['total_vol']/1e8:.1f}")
     with col2:
         if not hs300.empty:
-            filtered = hs300[(hs300['trade_date']>=pd.Timestamp(start)) & (hs300['trade_date']<=pd.Timestamp(end))]
+            filtered = TradingCalendar(hs300['trade_date']).slice(hs300, start, end)
             fig = px.line(filtered, x='trade_date', y='close', title="沪深300指数走势")
             st.plotly_chart(fig, use_container_width=True)
     st.markdown("### 行业统计分析")
-    if not fin.empty and not industry_info.empty:
-        merged = pd.merge(fin, industry_info[['股票代码','新版一级行业']], left_on='ts_code', right_on='股票代码', how='inner')
-        if not merged.empty:
-            stats = merged.groupby(['新版一级行业','年度']).agg({'营业收入':'sum','营业利润':'sum'}).reset_index()
-            stats['营收增长率'] = stats.groupby('新版一级行业')['营业收入'].pct_change()*100
-            st.dataframe(stats[stats['年度']==stats['年度'].max()])
+    stats = financials.industry_year() if financials is not None else pd.DataFrame()
+    if not stats.empty:
+        st.dataframe(stats)
 
+@uses_datasets('industry_info', 'adj_trade_data', 'hs300_data', 'company_info', 'industry_index', 'market_summary', 'financials')
 def display_industry_analysis(data, industry_name):
     st.markdown(f'<h1 class="main-header">🏭 {industry_name}行业分析</h1>', unsafe_allow_html=True)
     industry_info = data.get('industry_info', pd.DataFrame())
-    adj_trade = data.get('adj_trade_data', pd.DataFrame())
+    store = data.store('adj_trade_data')
     hs300 = data.get('hs300_data', pd.DataFrame())
     company_info = data.get('company_info', pd.DataFrame())
-    fin_data = data.get('fin_data', pd.DataFrame())
+    financials = data.financials()
     industry_info['股票代码'] = industry_info['股票代码'].astype(str).str.strip()
     stocks = industry_info[industry_info['新版一级行业']==industry_name]['股票代码'].tolist()
     if not stocks:
@@ -409,17 +1922,13 @@ def display_industry_analysis(data, industry_name):
         return
     col1,col2,col3,col4 = st.columns(4)
     col1.metric("股票数量", len(stocks))
-    if not adj_trade.empty:
-        latest = adj_trade['trade_date'].max()
-        recent = adj_trade[(adj_trade['ts_code'].isin(stocks)) & (adj_trade['trade_date']==latest)]
-        avg = recent['pct_chg'].mean() if not recent.empty else 0
-        col2.metric("近期平均涨跌", f"{avg:.2f}%")
-    if not adj_trade.empty:
-        ind_data = adj_trade[adj_trade['ts_code'].isin(stocks)]
-        if not ind_data.empty:
-            idx = ind_data.groupby('trade_date').apply(lambda x: (x['close']*x['vol']).sum()/x['vol'].sum()).reset_index()
-            idx.columns=['trade_date','price']
-            fig = px.line(idx, x='trade_date', y='price', title=f'{industry_name}行业指数')
+    ind_index = data.industry_index()
+    if ind_index is not None and not ind_index.empty:
+        recent = data.market_summary().industry_latest(industry_name)
+        col2.metric("近期平均涨跌", f"{recent['pct_chg'] if recent is not None else 0:.2f}%")
+        ind_rows = ind_index.loc[industry_name] if industry_name in ind_index.index.get_level_values(0) else None
+        if ind_rows is not None:
+            fig = px.line(ind_rows.reset_index(), x='trade_date', y='price', title=f'{industry_name}行业指数')
             st.plotly_chart(fig, use_container_width=True)
     tab_names = ["📊 行业指数交易数据", "🏢 上市公司信息", "💹 股票交易数据", "💰 财务数据", "⭐ 综合评价分析", "📈 股票价格涨跌趋势分析"]
     tab_objs = st.tabs(tab_names)
@@ -433,15 +1942,15 @@ def display_industry_analysis(data, industry_name):
                     ind_com = company_info[company_info['ts_code'].isin(stocks)]
                     st.dataframe(ind_com)
             elif tab_names[idx] == "💹 股票交易数据":
-                if not adj_trade.empty:
-                    latest_trade = adj_trade[adj_trade['ts_code'].isin(stocks) & (adj_trade['trade_date']==adj_trade['trade_date'].max())]
+                if store is not None and len(store):
+                    latest_trade = store.latest(stocks)
                     latest_trade = pd.merge(latest_trade, industry_info[['股票代码','公司简称']], left_on='ts_code', right_on='股票代码')
                     st.dataframe(latest_trade[['公司简称','close','pct_chg','vol']])
             elif tab_names[idx] == "💰 财务数据":
-                if not fin_data.empty:
-                    fin = fin_data[fin_data['股票代码'].isin(stocks)]
+                if financials is not None:
+                    fin = financials.latest(stocks)
                     if not fin.empty:
-                        st.dataframe(fin[fin['年度']==fin['年度'].max()])
+                        st.dataframe(fin)
             elif tab_names[idx] == "⭐ 综合评价分析":
                 display_comprehensive_evaluation(data, industry_name, stocks)
             elif tab_names[idx] == "📈 股票价格涨跌趋势分析":
@@ -449,34 +1958,39 @@ def display_industry_analysis(data, industry_name):
 
 def display_comprehensive_evaluation(data, industry_name, industry_stocks):
     st.markdown("#### 综合评价分析")
-    fin_data = data.get('fin_data', pd.DataFrame())
-    adj_trade = data.get('adj_trade_data', pd.DataFrame())
+    financials = data.financials()
     hs300 = data.get('hs300_data', pd.DataFrame())
-    if fin_data.empty: return
-    year = st.selectbox("评价年度", [2024,2023,2022], key="comp_year")
-    rank = st.selectbox("排名数量", [5,10,15], key="comp_rank")
-    fin = fin_data[fin_data['股票代码'].isin(industry_stocks) & (fin_data['年度']==year)].copy()
-    if not fin.empty and '净资产收益率' in fin.columns and '营业收入' in fin.columns:
-        fin['综合得分'] = fin['净资产收益率'].fillna(0)*0.5 + (fin['净利润']/fin['营业收入']).fillna(0)*0.5
-        top = fin.nlargest(rank, '综合得分')
-        st.dataframe(top[['股票代码','净资产收益率','营业收入','净利润','综合得分']])
+    if financials is None: return
+    col1, col2, col3 = st.columns(3)
+    year = col1.selectbox("评价年度", [2024,2023,2022], key="comp_year")
+    rank = col2.selectbox("排名数量", [5,10,15], key="comp_rank")
+    scope = col3.radio("评价范围", ["本行业", "全市场"], horizontal=True, key="comp_scope")
+    factors = st.multiselect("评价因子", list(FACTORS), default=list(DEFAULT_FACTOR_WEIGHTS), key="comp_factors")
+    if not factors: return
+    weight_cols = st.columns(len(factors))
+    weights = {f: weight_cols[i].number_input(f"{f}权重", 0.0, 1.0, DEFAULT_FACTOR_WEIGHTS.get(f, round(1/len(factors), 2)), 0.05, key=f"comp_w_{f}")
+               for i, f in enumerate(factors)}
+    col4, col5 = st.columns(2)
+    zscore = col4.checkbox("截面标准化(z-score)", True, key="comp_z")
+    neutralize = col5.checkbox("行业内标准化", False, key="comp_neutral", disabled=scope != "全市场" or not zscore)
+    top = rank_stocks(financials, year, weights, None if scope == "全市场" else industry_stocks, zscore=zscore,
+                      neutralize=neutralize and scope == "全市场", top=rank)
+    if not top.empty:
         start = st.date_input("回测开始", date(2024,1,1), key="comp_start")
         end = st.date_input("回测结束", date(2024,6,30), key="comp_end")
-        if not adj_trade.empty:
-            rets = []
-            for _, row in top.iterrows():
-                code = row['股票代码']
-                stock_data = adj_trade[adj_trade['ts_code']==code]
-                rets.append(calculate_cumulative_returns(stock_data, start, end))
-            avg_ret = np.mean(rets) if rets else 0
+        panel = data.panel('adj_trade_data')
+        if panel is not None:
+            top['区间收益率%'] = basket_returns(panel, top['股票代码'].tolist(), start, end).to_numpy()
+        st.dataframe(top[[c for c in ['股票代码','行业'] + factors + ['综合得分','区间收益率%'] if c in top.columns]])
+        if panel is not None:
             hs_ret = calculate_cumulative_returns(hs300, start, end) if not hs300.empty else 0
-            st.metric("组合收益率", f"{avg_ret:.2f}%")
+            st.metric("组合收益率", f"{top['区间收益率%'].mean():.2f}%")
             st.metric("沪深300收益率", f"{hs_ret:.2f}%")
 
 def display_trend_analysis(data, industry_name, industry_stocks):
     st.markdown("#### 股票价格涨跌趋势分析")
-    adj_trade = data.get('adj_trade_data', pd.DataFrame())
-    if adj_trade.empty: 
+    store = data.store('adj_trade_data')
+    if store is None or not len(store):
         st.warning("交易数据缺失")
         return
     
@@ -484,27 +1998,82 @@ def display_trend_analysis(data, industry_name, industry_stocks):
     st.markdown("##### 🤖 模型参数配置")
     col1, col2, col3 = st.columns(3)
     with col1:
-        model_type = st.selectbox("选择预测模型", ['逻辑回归', '支持向量机', '随机森林', '梯度提升树', '神经网络'], key="trend_model")
+        model_type = st.selectbox("选择预测模型", MODEL_TYPES, key="trend_model")
     with col2:
         target_days = st.slider("预测未来天数", 3, 10, 5, key="trend_days")
     with col3:
         test_ratio = st.slider("测试集比例%", 10, 40, 20, key="trend_test") / 100
     
+    col4, col5, col6 = st.columns(3)
+    with col4:
+        train_scope = st.radio("训练方式", ["单股模型", "行业合并模型"], horizontal=True, key="trend_scope")
+    with col5:
+        eval_mode = st.radio("验证方式", ["单次划分", "滚动前推验证"], horizontal=True, key="trend_eval", disabled=train_scope != "单股模型")
+    with col6:
+        n_folds = st.slider("前推折数", 3, 10, 5, key="trend_folds", disabled=train_scope != "单股模型" or eval_mode != "滚动前推验证")
     year = st.selectbox("分析年度", [2024,2023,2022], key="trend_year")
     stock = st.selectbox("选择股票", industry_stocks[:20], key="trend_stock")
-    stock_data = adj_trade[(adj_trade['ts_code']==stock) & (adj_trade['trade_date'].dt.year==year)]
+    stock_data = store.get_history(stock, date(year,1,1), date(year,12,31))
     if stock_data.empty:
         st.warning("无数据")
         return
-    tech = calculate_technical_indicators(stock_data)
-    st.line_chart(tech.set_index('trade_date')[['close','MA5','MA20']])
+    indicators = data.indicators('adj_trade_data')
+    if indicators is not None:
+        tech = indicators.get_history(stock, date(year,1,1), date(year,12,31))
+        st.line_chart(tech.set_index('trade_date')[['close','MA5','MA20']])
     
-    if st.button("启动模型训练", key="train_btn"):
+    train_clicked = st.button("启动模型训练", key="train_btn")
+    if train_clicked and train_scope == "行业合并模型":
+        with st.spinner(f"训练{industry_name}行业合并模型..."):
+            trained = train_pooled_model(store, industry_stocks, year, model_type,
+                                         target_days=target_days, test_ratio=test_ratio)
+            if trained:
+                entry, pooled = trained
+                c1, c2, c3, c4 = st.columns(4)
+                c1.metric("合并股票数", entry['n_stocks'])
+                c2.metric("合并样本数", entry['n_rows'])
+                c3.metric("验证集准确率", f"{entry['val_acc']:.2%}")
+                c4.metric("行业测试集准确率", f"{entry['test_acc']:.2%}")
+                rows, pred = pooled_stock_predictions(entry, pooled, stock)
+                test_rows = rows['Target'].notna().to_numpy() & (rows['trade_date'] >= entry['test_start']).to_numpy()
+                if test_rows.any():
+                    y_true, y_pred = rows['Target'].to_numpy()[test_rows].astype(int), pred[test_rows]
+                    st.metric(f"{stock}测试期准确率", f"{accuracy_score(y_true, y_pred):.2%}")
+                    cm = confusion_matrix(y_true, y_pred, labels=[-1, 0, 1])
+                    fig_cm = px.imshow(cm, text_auto=True, labels=dict(x="预测", y="实际"), x=['下跌','震荡','上涨'], y=['下跌','震荡','上涨'])
+                    st.plotly_chart(fig_cm, use_container_width=True)
+                if len(pred) > 0:
+                    strat = build_trading_strategy(pred, rows['close'].to_numpy(dtype=float))
+                    st.metric("策略总收益", f"{strat['total_return']:.2f}%")
+                    fig_strat = go.Figure()
+                    fig_strat.add_trace(go.Scatter(y=strat['portfolio_values'], mode='lines', name='策略净值'))
+                    fig_strat.update_layout(title='策略净值曲线（行业合并模型）')
+                    st.plotly_chart(fig_strat, use_container_width=True)
+                    industry_returns = pooled_strategy_returns(entry, pooled)
+                    st.metric("行业平均策略收益", f"{industry_returns.mean():.2f}%")
+                    st.plotly_chart(px.bar(industry_returns.sort_values().reset_index(), x='ts_code', y='策略收益率(%)',
+                                           title='行业内各股策略收益（合并模型信号）'), use_container_width=True)
+            else:
+                st.warning("数据不足，无法训练")
+    elif train_clicked and eval_mode == "滚动前推验证":
+        with st.spinner("各折并行训练中..."):
+            wf = walk_forward_evaluate(stock_data, model_type, target_days=target_days, n_folds=n_folds)
+            if wf:
+                folds, summary = wf
+                c1, c2, c3 = st.columns(3)
+                c1.metric("平均准确率", f"{summary['平均准确率']:.2%}")
+                c2.metric("准确率标准差", f"{summary['准确率标准差']:.2%}")
+                c3.metric("加权准确率", f"{summary['加权准确率']:.2%}")
+                st.dataframe(folds, hide_index=True)
+                st.plotly_chart(px.bar(folds, x='折', y='准确率', title='各折检验准确率'), use_container_width=True)
+            else:
+                st.warning("数据不足，无法训练")
+    elif train_clicked:
         with st.spinner("训练中..."):
-            res = prepare_model_data(stock_data, target_days=target_days)
-            if res:
-                X_train,y_train,X_val,y_val,X_test,y_test,scaler,feats = res
-                model,val_acc = train_model(model_type, X_train, y_train, X_val, y_val)
+            trained = train_model_cached(model_type, stock_data, target_days=target_days, test_ratio=test_ratio)
+            if trained:
+                entry, (X_train,y_train,X_val,y_val,X_test,y_test,scaler,feats) = trained
+                model, val_acc = entry['model'], entry['val_acc']
                 st.success(f"验证集准确率：{val_acc:.2%}")
                 y_pred = model.predict(X_test)
                 test_acc = accuracy_score(y_test, y_pred)
@@ -514,11 +2083,8 @@ def display_trend_analysis(data, industry_name, industry_stocks):
                 fig_cm = px.imshow(cm, text_auto=True, labels=dict(x="预测", y="实际"), x=['下跌','震荡','上涨'], y=['下跌','震荡','上涨'])
                 st.plotly_chart(fig_cm, use_container_width=True)
                 # 量化策略回测
-                all_pred = model.predict(scaler.transform(tech[feats].dropna()))
-                valid_idx = tech[feats].dropna().index
-                prices = tech.loc[valid_idx, 'close'].values
-                if len(all_pred) > 0:
-                    strat = build_trading_strategy(all_pred, prices)
+                strat = evaluate_strategy(model, scaler, feats, stock_data)
+                if strat:
                     st.metric("策略总收益", f"{strat['total_return']:.2f}%")
                     fig_strat = go.Figure()
                     fig_strat.add_trace(go.Scatter(y=strat['portfolio_values'], mode='lines', name='策略净值'))
@@ -527,24 +2093,60 @@ def display_trend_analysis(data, industry_name, industry_stocks):
             else:
                 st.warning("数据不足，无法训练")
     
+    with st.expander("🧪 参数批量扫描"):
+        sweep_models = st.multiselect("模型", MODEL_TYPES, default=MODEL_TYPES, key="sweep_models")
+        sweep_days = st.slider("预测天数范围", 3, 10, (3, 10), key="sweep_days")
+        sweep_thresholds = st.multiselect("涨跌标签阈值", [0.01, 0.02, 0.03, 0.05], default=[0.02], format_func=lambda x: f"±{x:.0%}", key="sweep_th")
+        sweep_stocks = st.multiselect("股票", industry_stocks, default=industry_stocks[:20], key="sweep_stocks")
+        if st.button("开始扫描", key="sweep_btn") and sweep_models and sweep_thresholds and sweep_stocks:
+            with st.spinner("并行扫描中..."):
+                st.session_state['sweep_results'] = run_parameter_sweep(store, sweep_stocks, year, sweep_models,
+                                                                        list(range(sweep_days[0], sweep_days[1]+1)), sweep_thresholds)
+        results = st.session_state.get('sweep_results')
+        if results is not None and not results.empty and '策略收益率(%)' in results.columns:
+            sort_col = st.selectbox("排序依据", ['策略收益率(%)', '测试集准确率', '验证集准确率'], key="sweep_sort")
+            st.dataframe(results.sort_values(sort_col, ascending=False), hide_index=True)
+            summary = results.groupby(['模型', '预测天数'], as_index=False)['策略收益率(%)'].mean()
+            st.plotly_chart(px.line(summary, x='预测天数', y='策略收益率(%)', color='模型', markers=True, title='平均策略收益率'), use_container_width=True)
+
     # AI分析报告按钮
     st.markdown("##### 🧠 AI大模型解读与分析")
     api_key = st.session_state.get('api_key', '')
     if not api_key:
         st.warning("⚠️ 请在侧边栏输入API密钥以使用AI分析功能")
     if st.button("生成AI分析报告", type="secondary", disabled=not api_key):
-        with st.spinner("AI正在分析..."):
-            report = generate_ai_analysis(stock_data, industry_name, stock, year, api_key)
-            st.markdown('<div class="ai-analysis">', unsafe_allow_html=True)
-            st.markdown("### 🤖 AI智能分析报告")
-            st.markdown(report)
-            st.markdown("</div>", unsafe_allow_html=True)
+        st.markdown('<div class="ai-analysis">', unsafe_allow_html=True)
+        st.markdown("### 🤖 AI智能分析报告")
+        placeholder = st.empty()
+        placeholder.markdown("AI正在分析...")
+        report = generate_ai_analysis(stock_data, industry_name, stock, year, api_key, placeholder)
+        if report.startswith("AI分析失败"):
+            placeholder.markdown(report)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    with st.expander("📚 行业批量AI报告"):
+        if st.button(f"为{industry_name}全部股票生成{year}年报告", key="batch_report_btn", disabled=not api_key):
+            with st.spinner(f"生成{len(industry_stocks)}份报告（并发{effective_concurrency()}）..."):
+                started = time.perf_counter()
+                batch = generate_industry_reports(store, industry_stocks, industry_name, year, api_key)
+            if batch:
+                failed = sum(1 for r in batch['reports'] if r['error'])
+                st.success(f"完成{len(batch['reports'])}份（失败{failed}份），用时{time.perf_counter() - started:.1f}秒")
+        batches = list_report_batches()
+        if batches:
+            path = st.selectbox("已生成的报告", batches, format_func=lambda p: os.path.basename(p)[:-5], key="report_batch")
+            batch = load_report_batch(path)
+            if batch:
+                reports = {r['ts_code']: r for r in batch['reports']}
+                code = st.selectbox(f"股票（{batch['created']}，{batch['model']}）", list(reports), key="report_stock")
+                entry = reports[code]
+                st.markdown(entry['report'] if entry['report'] else f"生成失败: {entry['error']}")
 
+@uses_datasets('stock_basic', 'adj_trade_data', 'financials')
 def display_stock_analysis(data):
     st.markdown('<h1 class="main-header">📈 个股分析</h1>', unsafe_allow_html=True)
     stock_basic = data.get('stock_basic', pd.DataFrame())
-    adj_trade = data.get('adj_trade_data', pd.DataFrame())
-    fin_data = data.get('fin_data', pd.DataFrame())
+    financials = data.financials()
     if stock_basic.empty:
         st.warning("股票基础数据缺失")
         return
@@ -555,54 +2157,58 @@ def display_stock_analysis(data):
         info = stock_basic[stock_basic['ts_code']==stock_code]
         name = info['name'].iloc[0] if not info.empty else stock_code
         st.subheader(f"{name} ({stock_code})")
-        trade = adj_trade[adj_trade['ts_code']==stock_code].sort_values('trade_date')
+        trade = data.store('adj_trade_data').get_history(stock_code)
         if not trade.empty:
             fig = px.line(trade, x='trade_date', y='close', title="收盘价走势")
             st.plotly_chart(fig, use_container_width=True)
-            tech = calculate_technical_indicators(trade)
-            col1,col2 = st.columns(2)
-            with col1:
-                st.line_chart(tech.set_index('trade_date')[['RSI']])
-            with col2:
-                st.line_chart(tech.set_index('trade_date')[['MACD','MACD_Signal']])
-        if not fin_data.empty:
-            fin = fin_data[fin_data['股票代码']==stock_code].sort_values('年度', ascending=False)
+            indicators = data.indicators('adj_trade_data')
+            tech = indicators.get_history(stock_code) if indicators is not None else pd.DataFrame()
+            if not tech.empty:
+                col1,col2 = st.columns(2)
+                with col1:
+                    st.line_chart(tech.set_index('trade_date')[['RSI']])
+                with col2:
+                    st.line_chart(tech.set_index('trade_date')[['MACD','MACD_Signal']])
+        if financials is not None:
+            fin = financials.stock(stock_code)
             if not fin.empty:
                 st.subheader("历年财务指标")
-                st.dataframe(fin[['年度','营业收入','净利润','净资产收益率']])
+                st.dataframe(fin[[c for c in ('年度','营业收入','净利润','净资产收益率','营收增长率','净利润增长率') if c in fin.columns]])
 
+@uses_datasets('stock_basic')
 def display_portfolio_backtest(data):
     st.markdown('<h1 class="main-header">💰 投资组合回测</h1>', unsafe_allow_html=True)
-    adj_trade = data.get('adj_trade_data', pd.DataFrame())
+    panel = data.panel('adj_trade_data')
     stock_basic = data.get('stock_basic', pd.DataFrame())
-    if adj_trade.empty or stock_basic.empty:
+    if panel is None or stock_basic.empty:
         st.warning("数据缺失")
         return
-    stocks = st.multiselect("选择股票（最多5只）", stock_basic['ts_code'].astype(str).tolist(), max_selections=5)
+    stocks = st.multiselect("选择股票", stock_basic['ts_code'].astype(str).tolist())
+    col1, col2, col3 = st.columns(3)
+    use_all = col1.checkbox("全部股票", False, key="pf_all")
+    freq = col2.selectbox("调仓频率", list(REBALANCE_FREQS), index=0, key="pf_freq")
+    cost_bps = col3.number_input("单边交易费率(‱)", 0.0, 100.0, 0.0, 1.0, key="pf_cost")
+    if use_all: stocks = panel.codes.tolist()
+    weighting = st.radio("权重方式", ["等权", "自定义权重"], horizontal=True, key="pf_weighting")
+    weights = None
+    if stocks and weighting == "自定义权重":
+        edited = st.data_editor(pd.DataFrame({'股票代码': stocks, '权重': 1.0}), disabled=['股票代码'], hide_index=True, key="pf_weights")
+        weights = dict(zip(edited['股票代码'], edited['权重'].clip(lower=0)))
     start = st.date_input("开始日期", date(2024,1,1))
     end = st.date_input("结束日期", date(2024,6,30))
     if stocks and st.button("开始回测"):
-        prices = {}
-        for code in stocks:
-            df = adj_trade[(adj_trade['ts_code']==code) & (adj_trade['trade_date']>=pd.Timestamp(start)) & (adj_trade['trade_date']<=pd.Timestamp(end))]
-            if not df.empty:
-                df = df.set_index('trade_date')['close']
-                prices[code] = df
-        if prices:
-            all_dates = pd.concat(prices.values(), axis=1).dropna().index
-            equal_weights = 1/len(stocks)
-            port_val = pd.Series(1.0, index=all_dates)
-            for code in stocks:
-                ret = prices[code].pct_change().fillna(0)
-                port_val = port_val * (1 + equal_weights * ret).fillna(1)
-            port_val = port_val.cumprod()
-            fig = px.line(x=port_val.index, y=port_val, title="等权组合净值")
+        close = panel.frame('close', stocks, start, end).dropna(axis=1, how='all').dropna(how='all')
+        if len(close) > 1:
+            nav, stats = portfolio_backtest(close, weights, REBALANCE_FREQS[freq], cost_bps)
+            fig = px.line(x=nav.index, y=nav, title=f"{weighting}组合净值（{freq}调仓，{close.shape[1]}只股票）")
             st.plotly_chart(fig, use_container_width=True)
-            st.metric("累计收益率", f"{(port_val.iloc[-1]-1)*100:.2f}%")
+            cols = st.columns(len(stats))
+            for col, (label, value) in zip(cols, stats.items()):
+                col.metric(label, f"{value:.0f}" if label == '调仓次数' else f"{value:.2f}%")
 
 # ========== 主函数 ==========
 def main():
-    data = load_data()
+    data = LazyData()
     st.markdown('<h1 class="main-header">金融数据挖掘及其综合应用平台</h1>', unsafe_allow_html=True)
     st.markdown('<h3 class="sub-header">—— 智能投研分析平台 ——</h3>', unsafe_allow_html=True)
 
@@ -627,7 +2233,10 @@ def main():
         if api_key_input:
             st.session_state['api_key'] = api_key_input
 
-    # 显示对应模块
+    # 显示对应模块（仅预加载该模块声明的数据集）
+    view = {"市场总览": display_market_overview, "行业分析": display_industry_analysis,
+            "个股分析": display_stock_analysis, "投资组合回测": display_portfolio_backtest}[module]
+    data.preload(view.datasets)
     if module == "市场总览":
         display_market_overview(data)
     elif module == "行业分析" and industry_name:
@@ -637,11 +2246,77 @@ def main():
     elif module == "投资组合回测":
         display_portfolio_backtest(data)
 
+    # 数据加载诊断
+    with st.sidebar.expander("🧮 内存占用"):
+        st.dataframe(memory_report(data.loaded(), data.mapped()), hide_index=True)
+    if INGEST_TIMINGS:
+        with st.sidebar.expander("⏱️ 数据加载耗时"):
+            timings = pd.DataFrame([(os.path.basename(p), secs, rows) for p, (secs, rows) in INGEST_TIMINGS.items()], columns=['文件', '耗时(秒)', '行数'])
+            st.dataframe(timings.sort_values('耗时(秒)', ascending=False), hide_index=True)
+
     # 全局AI对话（侧边栏底部）
     render_global_chat(data, module, industry_name, st.session_state.get("current_stock", None))
 
     st.markdown("---")
     st.markdown("<div class='footer'>数据仅供参考，AI分析不构成投资建议。</div>", unsafe_allow_html=True)
 
+# ========== 命令行 ==========
+def cli(argv):
+    parser = argparse.ArgumentParser(description="金融数据挖掘平台命令行工具")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('memory-report', help='加载全部数据集并输出各表内存占用')
+    sweep = sub.add_parser('sweep', help='批量扫描模型参数组合并输出结果表')
+    sweep.add_argument('--industry', help='申万一级行业，取该行业全部股票')
+    sweep.add_argument('--stocks', nargs='*', default=[], help='股票代码，可与--industry同时使用')
+    sweep.add_argument('--year', type=int, default=2024)
+    sweep.add_argument('--models', nargs='*', default=MODEL_TYPES)
+    sweep.add_argument('--days', nargs='*', type=int, default=list(range(3, 11)))
+    sweep.add_argument('--thresholds', nargs='*', type=float, default=[0.02])
+    sweep.add_argument('--workers', type=int, default=MODEL_WORKERS)
+    sweep.add_argument('--output', help='结果CSV路径（默认仅写入缓存目录）')
+    reports = sub.add_parser('reports', help='为整个行业并发生成AI分析报告')
+    reports.add_argument('--industry', required=True, help='申万一级行业')
+    reports.add_argument('--year', type=int, default=2024)
+    reports.add_argument('--concurrency', type=int, default=LLM_MAX_CONCURRENCY, help=f"并发请求数，上限{LLM_MAX_CONCURRENCY}")
+    append = sub.add_parser('append-bars', help='追加新交易日复权行情并增量计算技术指标')
+    append.add_argument('file', help='新K线CSV，列与复权交易数据一致')
+    append.add_argument('--output', help='新增行指标CSV路径')
+    args = parser.parse_args(argv)
+    if args.command == 'memory-report':
+        print(memory_report(load_data()).to_string(index=False))
+    elif args.command == 'sweep':
+        stocks = list(args.stocks)
+        if args.industry:
+            info = load_dataset('industry_info', dataset_signature('industry_info'))
+            stocks += info[info['新版一级行业']==args.industry]['股票代码'].tolist()
+        store = load_price_store('adj_trade_data', dataset_signature('adj_trade_data'))
+        results = run_parameter_sweep(store, stocks, args.year, args.models, args.days, args.thresholds, args.workers)
+        if args.output: results.to_csv(args.output, index=False, encoding='utf-8-sig')
+        if '策略收益率(%)' in results.columns: results = results.sort_values('策略收益率(%)', ascending=False)
+        print(results.to_string(index=False))
+    elif args.command == 'reports':
+        info = load_dataset('industry_info', dataset_signature('industry_info'))
+        stocks = info[info['新版一级行业']==args.industry]['股票代码'].tolist()
+        store = load_price_store('adj_trade_data', dataset_signature('adj_trade_data'))
+        api_key = os.environ.get("OPENAI_API_KEY", "") or DEFAULT_API_KEY
+        if effective_concurrency(args.concurrency) != args.concurrency:
+            print(f"--concurrency {args.concurrency} 超出范围，实际并发{effective_concurrency(args.concurrency)}（LLM_MAX_CONCURRENCY={LLM_MAX_CONCURRENCY}）")
+        started = time.perf_counter()
+        batch = generate_industry_reports(store, stocks, args.industry, args.year, api_key, args.concurrency)
+        if batch is None:
+            print("无交易数据")
+        else:
+            failed = sum(1 for r in batch['reports'] if r['error'])
+            print(f"{len(batch['reports'])}份报告（并发{batch['concurrency']}），失败{failed}份，用时{time.perf_counter() - started:.1f}秒 -> {REPORT_DIR}")
+    elif args.command == 'append-bars':
+        rows = append_bars('adj_trade_data', pd.read_csv(args.file))
+        if rows is None:
+            print("无交易数据")
+        else:
+            if args.output: rows.to_csv(args.output, index=False, encoding='utf-8-sig')
+            print(f"追加{len(rows)}行，{rows['trade_date'].nunique()}个交易日")
+            if len(rows): print(rows[rows['trade_date'] == rows['trade_date'].max()].to_string(index=False))
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1: cli(sys.argv[1:])
+    else: main()
@@ -0,0 +1,20 @@
+# ========== 进程池任务入口 ==========
+# streamlit每次rerun都会换掉sys.modules['__main__']，脚本里定义的函数按"__main__.名称"pickle，
+# 若提交任务期间有其他会话rerun，pickle会报"not the same object as __main__.xxx"。
+# 进程池因此只pickle本模块的run和任务名，由子进程在注册表中找到真正的函数
+import functools
+import importlib
+
+TASKS = {}
+
+def task(func):
+    TASKS[func.__name__] = func
+    return func
+
+def run(name, arg):
+    # fork出的子进程继承注册表；spawn/forkserver启动的子进程需导入主模块重新注册
+    if name not in TASKS: importlib.import_module('main_app')
+    return TASKS[name](arg)
+
+def bind(func):
+    return functools.partial(run, func.__name__)
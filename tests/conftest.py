@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def make_bars():
+    # 合成日线：spans为每只股票在交易日序列上的[起, 止)区间，gaps为{股票序号: 停牌日下标}
+    def make(periods, spans, seed=0, gaps=None):
+        rng = np.random.default_rng(seed)
+        dates = pd.bdate_range('2024-01-01', periods=periods)
+        frames = []
+        for i, (lo, hi) in enumerate(spans):
+            d = dates[lo:hi]
+            if gaps and i in gaps: d = d.delete(gaps[i])
+            close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, len(d))))
+            frames.append(pd.DataFrame({
+                'ts_code': f'60000{i}.SH', 'trade_date': d, 'close': close,
+                'high': close * (1 + rng.uniform(0, 0.03, len(d))), 'low': close * (1 - rng.uniform(0, 0.03, len(d))),
+                'vol': rng.uniform(1e5, 1e6, len(d)), 'pct_chg': rng.normal(0, 2, len(d)),
+            }))
+        return pd.concat(frames, ignore_index=True), dates
+    return make
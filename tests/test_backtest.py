@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from main_app import batch_backtest, build_trading_strategy, pad_series
+
+
+def make_series(rng, n, kind):
+    prices = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    if kind == 'alternating':
+        signals = np.where(np.arange(n) % 2 == 0, 1, -1)
+    elif kind == 'sparse':
+        signals = rng.choice([-1, 0, 1], n, p=[0.03, 0.94, 0.03])
+    else:
+        signals = rng.choice([-1, 0, 1], n)
+    return signals, prices
+
+
+@pytest.mark.parametrize('kind', ['random', 'alternating', 'sparse'])
+def test_batch_backtest_matches_single_series(kind):
+    rng = np.random.default_rng(0)
+    series = [make_series(rng, n, kind) for n in rng.integers(1, 300, 60)]
+    res = batch_backtest(pad_series([s for s, _ in series], 0), pad_series([p for _, p in series]))
+    for i, (signals, prices) in enumerate(series):
+        ref = build_trading_strategy(signals, prices)
+        n = len(prices)
+        assert np.array_equal(res['portfolio_values'][i, :n], ref['portfolio_values'])
+        assert np.array_equal(res['positions'][i, :n], ref['positions'])
+        assert np.isnan(res['portfolio_values'][i, n:]).all()
+        assert res['total_return'][i] == ref['total_return']
+        assert res['final_portfolio_value'][i] == ref['final_portfolio_value']
+
+
+def test_batch_backtest_cash_too_small_to_buy():
+    signals = np.array([[1, 1, -1, 1]])
+    prices = np.array([[2e6, 3e6, 1e6, 5e5]])
+    res = batch_backtest(signals, prices)
+    ref = build_trading_strategy(signals[0], prices[0])
+    assert np.array_equal(res['portfolio_values'][0], ref['portfolio_values'])
+    assert res['positions'][0].tolist() == [0, 0, 0, 2]
+
+
+def test_empty_series():
+    assert build_trading_strategy([], [])['total_return'] == 0
+    res = batch_backtest(np.zeros((2, 0)), np.zeros((2, 0)))
+    assert res['total_return'].tolist() == [0, 0]
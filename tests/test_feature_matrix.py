@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+
+from main_app import build_feature_matrix
+
+
+def test_rows_without_future_price_are_dropped():
+    rng = np.random.default_rng(0)
+    n, target_days = 120, 5
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    stock = pd.DataFrame({'trade_date': pd.bdate_range('2024-01-01', periods=n), 'close': close,
+                          'high': close * 1.01, 'low': close * 0.99, 'vol': rng.uniform(1e5, 1e6, n)})
+    X, y, _ = build_feature_matrix(stock, target_days)
+    assert X.index.max() == n - 1 - target_days
+    future = close[X.index + target_days] / close[X.index] - 1
+    assert np.array_equal(y.to_numpy(), np.where(future > 0.02, 1, np.where(future < -0.02, -1, 0)))
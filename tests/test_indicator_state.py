@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from main_app import (INDICATOR_COLUMNS, GroupLayout, IndicatorState, PriceStore, calculate_technical_indicators,
+                      compute_universe_indicators)
+
+REPLAY_DAYS = 30
+
+
+# 第4只在回放期内才上市，第5只中途停牌数日
+SPANS = [(0, 150), (10, 150), (0, 140), (150 - REPLAY_DAYS + 10, 150), (0, 150)]
+GAPS = {4: range(118, 124)}
+
+
+def replay(bars, dates):
+    cut = dates[-REPLAY_DAYS - 1]
+    state = IndicatorState.from_store(PriceStore(bars[bars['trade_date'] <= cut]))
+    new = bars[bars['trade_date'] > cut].sort_values(['trade_date', 'ts_code'])
+    return pd.concat([state.update(day) for _, day in new.groupby('trade_date')], ignore_index=True), state
+
+
+def test_update_matches_full_recompute(make_bars):
+    bars, dates = make_bars(150, SPANS, 0, GAPS)
+    rows, state = replay(bars, dates)
+    full = compute_universe_indicators(PriceStore(bars))
+    expected = full[full['trade_date'] > dates[-REPLAY_DAYS - 1]]
+    key = ['ts_code', 'trade_date']
+    merged = expected.merge(rows, on=key, suffixes=('', '_inc'))
+    assert len(merged) == len(expected) == len(rows)
+    assert '600003.SH' in set(rows['ts_code'])
+    for col in INDICATOR_COLUMNS:
+        assert np.allclose(merged[col], merged[f'{col}_inc'], rtol=1e-9, atol=1e-9, equal_nan=True), col
+    assert sorted(state.codes) == sorted(bars['ts_code'].unique())
+
+
+def test_update_on_empty_history(make_bars):
+    bars, dates = make_bars(150, SPANS, 1, GAPS)
+    state = IndicatorState.from_store(PriceStore(bars.iloc[:0]))
+    rows = pd.concat([state.update(day) for _, day in bars.groupby('trade_date')], ignore_index=True)
+    full = compute_universe_indicators(PriceStore(bars))
+    merged = full.merge(rows, on=['ts_code', 'trade_date'], suffixes=('', '_inc'))
+    assert len(merged) == len(bars)
+    for col in INDICATOR_COLUMNS:
+        assert np.allclose(merged[col], merged[f'{col}_inc'], rtol=1e-9, atol=1e-9, equal_nan=True), col
+
+
+def test_buffers_hold_latest_window(make_bars):
+    bars, dates = make_bars(150, SPANS, 2, GAPS)
+    _, state = replay(bars, dates)
+    store = PriceStore(bars)
+    for i, code in enumerate(state.codes):
+        for k in ('close', 'high', 'low', 'vol'):
+            hist = store.get_history(code)[k].to_numpy(dtype=float)[-IndicatorState.WINDOWS[k]:]
+            assert np.allclose(state.buffers[k][i, -len(hist):], hist)
+
+
+def test_append_bars_continues_from_saved_state(tmp_path, monkeypatch, make_bars):
+    import main_app
+    monkeypatch.chdir(tmp_path)
+    bars, dates = make_bars(150, SPANS, 3, GAPS)
+    raw = bars.assign(trade_date=bars['trade_date'].dt.strftime('%Y%m%d').astype(int))
+    head, tail = raw[bars['trade_date'] <= dates[-REPLAY_DAYS - 1]], raw[bars['trade_date'] > dates[-REPLAY_DAYS - 1]]
+    for i, path in enumerate(main_app.DATASETS['adj_trade_data'][1]):
+        head.iloc[i::3].to_csv(path, index=False)
+    mid = dates[-REPLAY_DAYS // 2]
+    first = main_app.append_bars('adj_trade_data', tail[tail['trade_date'] <= int(mid.strftime('%Y%m%d'))])
+    assert len(main_app.glob.glob('.data_cache/indicator-state-*.npz')) == 1
+    second = main_app.append_bars('adj_trade_data', tail)
+    assert main_app.append_bars('adj_trade_data', tail).empty
+    rows = pd.concat([first, second], ignore_index=True)
+    assert len(rows) == len(tail)
+    full = compute_universe_indicators(PriceStore(main_app.build_dataset('adj_trade_data')))
+    expected = full[full['trade_date'] > dates[-REPLAY_DAYS - 1]]
+    merged = expected.merge(rows, on=['ts_code', 'trade_date'], suffixes=('', '_inc'))
+    assert len(merged) == len(tail)
+    for col in INDICATOR_COLUMNS:
+        assert np.allclose(merged[col], merged[f'{col}_inc'], rtol=1e-9, atol=1e-9, equal_nan=True), col
+
+
+def test_rolling_mean_skips_non_finite():
+    x = np.arange(20.0)
+    x[3], x[12] = np.inf, -np.inf
+    layout = GroupLayout(np.array([0, 10]), np.array([10, 20]))
+    expected = pd.Series(x).groupby(np.repeat([0, 1], 10)).transform(lambda g: g.rolling(3, min_periods=1).mean())
+    assert np.allclose(layout.rolling_mean(x, 3), expected, equal_nan=True)
+
+
+def test_update_matches_full_recompute_with_infinite_k(make_bars):
+    bars, dates = make_bars(150, SPANS, 4, GAPS)
+    # 脏数据：收盘价高于最高价且连续一字，K的分母为0得到inf，D为K的滚动均值
+    flat = (bars['ts_code'] == '600000.SH') & bars['trade_date'].between(dates[-20], dates[-8])
+    bars.loc[flat, ['high', 'low']] = 10.0
+    bars.loc[flat, 'close'] = 11.0
+    rows, _ = replay(bars, dates)
+    full = compute_universe_indicators(PriceStore(bars))
+    merged = full.merge(rows, on=['ts_code', 'trade_date'], suffixes=('', '_inc'))
+    assert np.isinf(merged['K']).any()
+    for col in INDICATOR_COLUMNS:
+        assert np.allclose(merged[col], merged[f'{col}_inc'], rtol=1e-9, atol=1e-9, equal_nan=True), col
+
+
+def test_universe_table_rows_match_single_stock(make_bars):
+    bars, _ = make_bars(150, SPANS, 5, GAPS)
+    store = PriceStore(bars)
+    table = PriceStore(compute_universe_indicators(store), presorted=True)
+    for code in store.offsets:
+        history = store.get_history(code)
+        if len(history) < 30: continue
+        expected = calculate_technical_indicators(history)
+        got = table.get_history(code)
+        for col in INDICATOR_COLUMNS:
+            assert np.allclose(got[col], expected[col], rtol=1e-9, atol=1e-9, equal_nan=True), (code, col)
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+from main_app import LLM_MAX_CONCURRENCY, ConcurrencyLimiter, effective_concurrency
+
+
+def test_effective_concurrency_is_clamped():
+    assert effective_concurrency() == LLM_MAX_CONCURRENCY
+    assert effective_concurrency(LLM_MAX_CONCURRENCY + 16) == LLM_MAX_CONCURRENCY
+    assert effective_concurrency(1) == 1
+    assert effective_concurrency(-3) == 1
+
+
+def test_async_waiters_never_exceed_limit():
+    limiter = ConcurrencyLimiter(3)
+    active, peak = [0], [0]
+
+    async def one():
+        async with limiter:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.01)
+            active[0] -= 1
+
+    async def main():
+        await asyncio.gather(*(one() for _ in range(20)))
+
+    asyncio.run(main())
+    assert peak[0] == 3 and limiter._free == 3
+
+
+def test_cancelled_waiter_releases_slot():
+    limiter = ConcurrencyLimiter(1)
+
+    async def main():
+        await limiter.acquire_async()
+        waiter = asyncio.create_task(limiter.acquire_async())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release()
+        await asyncio.wait_for(limiter.acquire_async(), 1)
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter._free == 1 and not limiter._waiters
+
+
+def test_thread_release_wakes_async_waiter():
+    limiter = ConcurrencyLimiter(1)
+    limiter.acquire()
+
+    async def main():
+        threading.Timer(0.05, limiter.release).start()
+        await asyncio.wait_for(limiter.acquire_async(), 2)
+        limiter.release()
+
+    asyncio.run(main())
+    with limiter:
+        assert limiter._free == 0
+    assert limiter._free == 1
@@ -0,0 +1,46 @@
+import pickle
+import sys
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import pool_tasks
+
+SCRIPT = '''
+import pool_tasks
+
+@pool_tasks.task
+def square_task(x):
+    return x * x
+'''
+
+
+def run_script():
+    # 模拟streamlit rerun：每次执行脚本都生成新的__main__模块
+    module = types.ModuleType('__main__')
+    exec(SCRIPT, module.__dict__)
+    sys.modules['__main__'] = module
+    return module
+
+
+@pytest.fixture
+def fake_main():
+    original = sys.modules['__main__']
+    yield run_script
+    sys.modules['__main__'] = original
+
+
+def test_bound_task_survives_rerun(fake_main):
+    first = fake_main()
+    fake_main()
+    with pytest.raises(pickle.PicklingError):
+        pickle.dumps(first.square_task)
+    assert pickle.loads(pickle.dumps(pool_tasks.bind(first.square_task)))(7) == 49
+
+
+def test_bound_task_runs_in_process_pool(fake_main):
+    first = fake_main()
+    with ProcessPoolExecutor(max_workers=2) as ex:
+        fake_main()
+        assert list(ex.map(pool_tasks.bind(first.square_task), range(5))) == [0, 1, 4, 9, 16]
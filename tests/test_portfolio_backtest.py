@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from main_app import portfolio_backtest, rebalance_points
+
+
+def reference_nav(close, weights, freq, cost_bps):
+    # 逐日持股数推进的参考实现：调仓日按收盘价把净值（扣除成交成本后）按目标权重分配到已上市股票
+    points = set(rebalance_points(close.index, freq).tolist())
+    prices = close.ffill().to_numpy()
+    value, shares, navs = 1.0, np.zeros(close.shape[1]), []
+    for t in range(len(prices)):
+        p = prices[t]
+        if t > 0:
+            value = np.nansum(shares * p)
+        if t in points:
+            listed = ~np.isnan(p)
+            target = np.where(listed, weights, 0.0)
+            target = target / target.sum()
+            current = np.where(shares > 0, shares * np.nan_to_num(p), 0.0) / value if t > 0 else np.zeros_like(target)
+            value *= 1 - np.abs(target - current).sum() * cost_bps / 1e4
+            shares = np.where(listed, target * value / np.where(listed, p, 1.0), 0.0)
+        navs.append(value)
+    return np.array(navs)
+
+
+@pytest.fixture
+def close():
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range('2022-01-03', periods=400)
+    values = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (400, 60)), axis=0))
+    values[:90, :8] = np.nan  # 区间中途上市
+    values[300:, 8:10] = np.nan  # 停牌/退市后沿用最后价格
+    return pd.DataFrame(values, index=dates)
+
+
+@pytest.mark.parametrize('freq', ['D', 'W', 'M', None])
+@pytest.mark.parametrize('cost_bps', [0.0, 10.0])
+def test_matches_daily_reference(close, freq, cost_bps):
+    weights = np.random.default_rng(1).random(close.shape[1])
+    nav, stats = portfolio_backtest(close, weights, freq, cost_bps)
+    expected = reference_nav(close, weights, freq, cost_bps)
+    assert np.allclose(nav.to_numpy(), expected, rtol=1e-12, atol=0)
+    assert stats['累计收益率'] == pytest.approx((expected[-1] - 1) * 100)
+    assert stats['调仓次数'] == len(rebalance_points(close.index, freq))
+
+
+def test_equal_weight_daily_rebalance_is_mean_return(close):
+    full = close.dropna(axis=1)
+    nav, _ = portfolio_backtest(full, None, 'D')
+    expected = np.cumprod(np.r_[1.0, (full.pct_change().iloc[1:]).mean(axis=1).to_numpy() + 1])
+    assert np.allclose(nav.to_numpy(), expected)
+
+
+def test_buy_and_hold_turnover_and_cost(close):
+    _, stats = portfolio_backtest(close, None, None, 25.0)
+    assert stats['累计换手率'] == pytest.approx(100.0)
+    assert stats['交易成本'] == pytest.approx(0.25)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+
+import main_app
+from main_app import PriceStore, compact_frame, mapped_arrays, memory_report
+
+
+SPANS = [(0, 40), (15, 40), (0, 37), (39, 40)]
+
+
+def shuffled(bars, seed):
+    # 乱序输入，PriceStore负责排序
+    return compact_frame(bars.sample(frac=1, random_state=seed).reset_index(drop=True))
+
+
+def open_store(df, tmp_path, monkeypatch):
+    monkeypatch.setattr(main_app, 'CACHE_DIR', str(tmp_path))
+    arrays = mapped_arrays('store', 'test', 'sig', lambda: PriceStore(df).to_arrays())
+    assert isinstance(arrays['close'], np.memmap)
+    return PriceStore.from_arrays(arrays)
+
+
+def test_mapped_store_matches_in_memory(tmp_path, monkeypatch, make_bars):
+    bars, dates = make_bars(40, SPANS, 0)
+    df = shuffled(bars, 0)
+    mem, mapped = PriceStore(df), open_store(df, tmp_path, monkeypatch)
+    assert len(mapped) == len(mem)
+    tm.assert_frame_equal(mapped.frame, mem.frame)
+    for code in ['600000.SH', '600001.SH', '600002.SH', '600003.SH', '999999.SH']:
+        for start, end in [(None, None), (dates[10], dates[30]), (dates[39], None), ('2030-01-01', None)]:
+            tm.assert_frame_equal(mapped.get_history(code, start, end), mem.get_history(code, start, end))
+
+
+def test_latest_rows(tmp_path, monkeypatch, make_bars):
+    bars, dates = make_bars(40, SPANS, 1)
+    df = shuffled(bars, 1)
+    mem, mapped = PriceStore(df), open_store(df, tmp_path, monkeypatch)
+    codes = ['600000.SH', '600002.SH', '600003.SH', '999999.SH']
+    for store in (mem, mapped):
+        latest = store.latest(codes)
+        # 600002停牌于最后3日，不在最新交易日截面中
+        assert latest['ts_code'].astype(str).tolist() == ['600000.SH', '600003.SH']
+        assert (latest['trade_date'] == dates[-1]).all()
+    tm.assert_frame_equal(mapped.latest(codes), mem.latest(codes))
+    assert mapped.latest([]).empty
+
+
+def test_unwritable_cache_dir_falls_back_to_memory(tmp_path, monkeypatch, make_bars):
+    bars, _ = make_bars(40, SPANS, 2)
+    df = shuffled(bars, 2)
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+    monkeypatch.setattr(main_app, 'CACHE_DIR', str(blocker / 'cache'))
+    arrays = mapped_arrays('store', 'test', 'sig', lambda: PriceStore(df).to_arrays())
+    assert not isinstance(arrays['close'], np.memmap)
+    tm.assert_frame_equal(PriceStore.from_arrays(arrays).frame, PriceStore(df).frame)
+    assert list(tmp_path.iterdir()) == [blocker]
+
+
+def test_stale_versions_are_removed(tmp_path, monkeypatch, make_bars):
+    bars, _ = make_bars(40, SPANS, 3)
+    df = shuffled(bars, 3)
+    monkeypatch.setattr(main_app, 'CACHE_DIR', str(tmp_path))
+    for sig in ('old', 'new'):
+        mapped_arrays('store', 'test', sig, lambda: PriceStore(df).to_arrays())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['store-test-new']
+
+
+def test_memory_report_lists_mapped_stores(tmp_path, monkeypatch, make_bars):
+    bars, _ = make_bars(40, SPANS, 4)
+    df = shuffled(bars, 4)
+    store = open_store(df, tmp_path, monkeypatch)
+    report = memory_report({'stock_basic': df[['ts_code']]}, {'adj_trade_data（价格库）': store}).set_index('数据表')
+    row = report.loc['adj_trade_data（价格库）']
+    assert (row['行数'], row['列数'], row['存储']) == (len(df), df.shape[1], 'mmap共享')
+    assert row['内存(MB)'] * 2**20 >= df.drop(columns='ts_code').memory_usage(index=False).sum()
+    assert report.loc['stock_basic', '存储'] == 'DataFrame'